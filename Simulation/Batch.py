@@ -0,0 +1,151 @@
+"""
+Headless runner: runs a simulation without plotting and writes a JSON summary of it.
+
+    python Batch.py --config config.yaml --sim sim_002 --seed 0 --max-iterations 500 --output sim_002.json
+
+With --check-coverage it instead runs every simulation of the config file once per number of pushes per iteration,
+and exits with an error if any of them doesn't cover its map:
+
+    python Batch.py --check-coverage 2 3 --max-iterations 300
+
+Nothing here imports matplotlib, so it can run on machines without a display.
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from Controller import Controller
+from MapCache import load_catalog
+from Profiling import Profiler
+from Recording import Recorder
+
+
+def run(config_path: str, sim_id: str, seed: int = 0, max_iterations: int = 1000, verbose: bool = False,
+        profiler: Profiler = None, record: str = None, checkpoint: str = None, checkpoint_every: int = 100,
+        resume: str = None, pushes_per_iteration: int = None, verify_fence: bool = False) -> dict:
+    """
+    Run sim_id until the map is covered or max_iterations (counting the iterations run before a checkpoint when
+    resuming from one). With checkpoint, the state is saved there every checkpoint_every iterations and at the end.
+    verify_fence checks the incremental fence subcomplex against a full recompute every iteration.
+    """
+    if resume is None:
+        random.seed(seed)
+        np.random.seed(seed)
+
+    # The controller reports progress with print, only kept when verbose
+    stdout = sys.stdout if verbose else io.StringIO()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(stdout):
+            # The random generators are restored from the checkpoint
+            controller = Controller.load_checkpoint(resume) if resume else Controller(config_path, sim_id)
+            if pushes_per_iteration is not None:
+                controller.pushes_per_iteration = pushes_per_iteration
+            if verify_fence:
+                controller.verify_fence_subcomplex = True
+            if profiler is not None:
+                profiler.attach(controller)
+            if record is not None:
+                controller.recorder = Recorder(record, controller.map)
+            while not controller.is_full_covered and controller.iterations < max_iterations:
+                controller.run_iter()
+                if checkpoint and controller.iterations % checkpoint_every == 0:
+                    controller.save_checkpoint(checkpoint)
+        wall_time = time.perf_counter() - start
+    finally:
+        # Don't leave the helpers of Utils patched if the run failed
+        if profiler is not None:
+            profiler.detach()
+    if record is not None:
+        controller.recorder.close()
+    if checkpoint:
+        controller.save_checkpoint(checkpoint)
+
+    return {
+        'config': config_path,
+        'sim_id': sim_id,
+        'seed': seed,
+        'max_iterations': max_iterations,
+        'resumed_from': resume,
+        'iterations': controller.iterations,
+        'pushes_per_iteration': controller.pushes_per_iteration,
+        'robots': len(controller.robots),
+        'coverage': 'complete' if controller.is_full_covered else 'iteration_cap',
+        'frontier_simplices': len(controller.fence_subcomplex.frontier_simplices),
+        'wall_time': wall_time,
+        'phase_times': dict(controller.phase_times),
+    }
+
+
+def check_coverage(config_path: str, sim_ids: list[str], pushes: list[int], seed: int = 0,
+                   max_iterations: int = 1000) -> list[dict]:
+    """
+    Run each simulation with each number of pushes per iteration, returns the summaries of the runs that didn't cover
+    the map within max_iterations
+    """
+    failed = []
+    for sim_id in sim_ids:
+        for pushes_per_iteration in pushes:
+            summary = run(config_path, sim_id, seed, max_iterations, pushes_per_iteration=pushes_per_iteration)
+            print(f'{sim_id} pushes={pushes_per_iteration}: {summary["coverage"]} in {summary["iterations"]} '
+                  f'iterations, {summary["robots"]} robots', file=sys.stderr)
+            if summary['coverage'] != 'complete':
+                failed.append(summary)
+    return failed
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Run a simulation without plotting and write a JSON summary.')
+    parser.add_argument('--config', default='config.yaml', help='config file, relative to this directory')
+    parser.add_argument('--sim', help='simulation id in the config file, sim_001 if not given')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-iterations', type=int, default=1000)
+    parser.add_argument('--output', help='JSON file to write the summary to, stdout if not given')
+    parser.add_argument('--verbose', action='store_true', help="keep the controller's progress messages")
+    parser.add_argument('--profile', help='JSON lines file to write the per phase/iteration profile to')
+    parser.add_argument('--trace', help='Chrome trace-event file to write the profile to')
+    parser.add_argument('--trace-memory', action='store_true', help='add tracemalloc deltas to the profile')
+    parser.add_argument('--record', help='directory to record the iterations to, see Replay.py')
+    parser.add_argument('--checkpoint', help='file to save the state of the simulation to, to resume it later')
+    parser.add_argument('--checkpoint-every', type=int, default=100, help='iterations between checkpoints')
+    parser.add_argument('--resume', help='checkpoint to continue the simulation from, instead of starting it')
+    parser.add_argument('--pushes', type=int, help='robots pushed per iteration along disjoint skeleton paths '
+                                                   '(pushes_per_iteration of the config, 1 if not set there)')
+    parser.add_argument('--verify-fence', action='store_true',
+                        help='check the incremental fence subcomplex against a full recompute every iteration (slow)')
+    parser.add_argument('--check-coverage', nargs='+', type=int, metavar='PUSHES',
+                        help='run every simulation of the config file (or --sim) with each of these pushes per '
+                             'iteration, fail if one of them is not covered within --max-iterations')
+    args = parser.parse_args(argv)
+
+    if args.check_coverage:
+        sim_ids = [args.sim] if args.sim else list(load_catalog(Path(__file__).parent / args.config))
+        failed = check_coverage(args.config, sim_ids, args.check_coverage, args.seed, args.max_iterations)
+        if failed:
+            sys.exit('not covered: ' + ', '.join(f'{summary["sim_id"]} with pushes={summary["pushes_per_iteration"]}'
+                                                 for summary in failed))
+        return
+
+    profiler = Profiler(args.trace_memory) if args.profile or args.trace else None
+    summary = run(args.config, args.sim or 'sim_001', args.seed, args.max_iterations, args.verbose, profiler, args.record,
+                  args.checkpoint, args.checkpoint_every, args.resume, args.pushes, args.verify_fence)
+    if args.profile:
+        profiler.to_jsonl(args.profile)
+    if args.trace:
+        profiler.to_chrome_trace(args.trace)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    else:
+        print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Scaling benchmark: runs the controller headless on generated maps until a number of robots is deployed, and reports
+the time spent in each phase of run_iter and the peak memory.
+
+    python Benchmark.py --maps open_room corridor_maze random_rectangles warehouse_racks --robots 100 1000 5000 --output bench.jsonl
+
+Maps are generated from a seed, so the same arguments always benchmark the same scenarios. Each result is one JSON
+line. Peak memory is measured with tracemalloc, which slows the run down; use --no-memory for timings only.
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import random
+import time
+import tracemalloc
+
+from Controller import Controller
+
+ROBOT_RADIUS = 1.414213562
+SIGMA = 0.2
+BETA = 0.02
+# Free area taken by each robot once the map is covered, used to size the maps for a number of robots
+AREA_PER_ROBOT = 3.0
+
+
+def _config(size: list[float], obstacles: list, entrypoint: list[float] = None) -> dict:
+    return {
+        'map': {'boundary': [[0, 0], size], 'obstacles': obstacles, 'entrypoint': entrypoint or [1, 1]},
+        'robot_radius': ROBOT_RADIUS,
+        'sigma': SIGMA,
+        'beta': BETA,
+    }
+
+
+def open_room(robots: int, seed: int = 0) -> dict:
+    """Square room without obstacles"""
+    side = math.ceil(math.sqrt(robots * AREA_PER_ROBOT))
+    return _config([side, side], [])
+
+
+def corridor_maze(robots: int, seed: int = 0, corridor: float = 4, wall: float = 0.4) -> dict:
+    """
+    Perfect maze (one path between any two cells, carved with a randomized depth first search) on a grid of
+    corridor wide cells. Walls are thin rectangular obstacles.
+    """
+    cells = max(2, math.ceil(math.sqrt(robots * AREA_PER_ROBOT) / corridor))
+    rng = random.Random(seed)
+
+    visited, open_walls = {(0, 0)}, set()
+    stack = [(0, 0)]
+    while stack:
+        x, y = stack[-1]
+        unvisited = [(x + dx, y + dy) for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))
+                     if 0 <= x + dx < cells and 0 <= y + dy < cells and (x + dx, y + dy) not in visited]
+        if not unvisited:
+            stack.pop()
+            continue
+        cell = rng.choice(unvisited)
+        open_walls.add(frozenset([(x, y), cell]))
+        visited.add(cell)
+        stack.append(cell)
+
+    obstacles = []
+    for x in range(cells):
+        for y in range(cells):
+            # Wall on the east and north sides of each inner cell, unless the maze goes through it
+            if x + 1 < cells and frozenset([(x, y), (x + 1, y)]) not in open_walls:
+                wx = (x + 1) * corridor
+                obstacles.append([[wx - wall / 2, y * corridor], [wx + wall / 2, (y + 1) * corridor]])
+            if y + 1 < cells and frozenset([(x, y), (x, y + 1)]) not in open_walls:
+                wy = (y + 1) * corridor
+                obstacles.append([[x * corridor, wy - wall / 2], [(x + 1) * corridor, wy + wall / 2]])
+    side = cells * corridor
+    return _config([side, side], obstacles)
+
+
+def random_rectangles(robots: int, seed: int = 0, density: float = 0.15, min_side: float = 1, max_side: float = 4) -> dict:
+    """Square room with non overlapping random rectangles covering about density of it, away from the entrypoint"""
+    side = math.ceil(math.sqrt(robots * AREA_PER_ROBOT / (1 - density)))
+    rng = random.Random(seed)
+    clearance = 2 * ROBOT_RADIUS
+
+    obstacles, area, attempts = [], 0, 0
+    while area < density * side * side and attempts < 100 * robots:
+        attempts += 1
+        w, h = rng.uniform(min_side, max_side), rng.uniform(min_side, max_side)
+        x, y = rng.uniform(0, side - w), rng.uniform(0, side - h)
+        if x < 1 + clearance and y < 1 + clearance:
+            continue  # keep the entrypoint free
+        # Keep a gap between rectangles so robots can go around each of them
+        if any(x - clearance < o_x2 and o_x1 < x + w + clearance and y - clearance < o_y2 and o_y1 < y + h + clearance
+               for (o_x1, o_y1), (o_x2, o_y2) in obstacles):
+            continue
+        obstacles.append([[x, y], [x + w, y + h]])
+        area += w * h
+    return _config([side, side], obstacles)
+
+
+def warehouse_racks(robots: int, seed: int = 0, bay: float = 1, aisle: float = 3) -> dict:
+    """
+    Warehouse floor: rows of back to back racks separated by aisles, every bay of a rack is its own rectangle (as in
+    maps exported from warehouse layouts). Gives thousands of rectangles from a few thousand robots on.
+    """
+    side = math.ceil(math.sqrt(robots * AREA_PER_ROBOT / (1 - 2 * bay / (2 * bay + aisle))))
+    obstacles = []
+    y = aisle
+    while y + 2 * bay <= side - aisle:
+        for row in range(2):
+            x = aisle
+            while x + bay <= side - aisle:
+                obstacles.append([[x, y + row * bay], [x + bay, y + (row + 1) * bay]])
+                x += bay
+        y += 2 * bay + aisle
+    return _config([side, side], obstacles)
+
+
+MAPS = {
+    'open_room': open_room,
+    'corridor_maze': corridor_maze,
+    'random_rectangles': random_rectangles,
+    'warehouse_racks': warehouse_racks,
+}
+
+
+def run_case(map_name: str, robots: int, seed: int = 0, max_iterations: int = None, trace_memory: bool = True,
+             pushes_per_iteration: int = 1) -> dict:
+    """Run the controller on a generated map until robots are deployed, the map is covered or max_iterations"""
+    config = MAPS[map_name](robots, seed)
+    config['pushes_per_iteration'] = pushes_per_iteration
+    # At most pushes_per_iteration robots are added per iteration, this leaves room for failed pushes
+    max_iterations = max_iterations or 4 * robots
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        controller = Controller.from_config(config)
+        iterations = 0
+        while not controller.is_full_covered and len(controller.robots) < robots and iterations < max_iterations:
+            controller.run_iter()
+            iterations += 1
+    wall_time = time.perf_counter() - start
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        'map': map_name,
+        'seed': seed,
+        'boundary': config['map']['boundary'],
+        'obstacles': len(config['map']['obstacles']),
+        'target_robots': robots,
+        'robots': len(controller.robots),
+        'pushes_per_iteration': pushes_per_iteration,
+        'iterations': iterations,
+        'covered': controller.is_full_covered,
+        'wall_time': wall_time,
+        'phase_times': dict(controller.phase_times),
+        'peak_memory': peak_memory,
+    }
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Benchmark the controller on generated maps.')
+    parser.add_argument('--maps', nargs='+', choices=sorted(MAPS), default=sorted(MAPS))
+    parser.add_argument('--robots', nargs='+', type=int, default=[100, 1000, 5000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-iterations', type=int, help='per case, 4 times the number of robots if not given')
+    parser.add_argument('--pushes', type=int, default=1, help='robots pushed per iteration')
+    parser.add_argument('--no-memory', action='store_true', help="don't trace memory (faster, peak_memory is null)")
+    parser.add_argument('--output', help='JSON lines file to append the results to, stdout if not given')
+    args = parser.parse_args(argv)
+
+    for robots in args.robots:
+        for map_name in args.maps:
+            result = run_case(map_name, robots, args.seed, args.max_iterations, not args.no_memory, args.pushes)
+            if args.output:
+                with open(args.output, 'a') as f:
+                    f.write(json.dumps(result) + '\n')
+            print(json.dumps(result), flush=True)
+
+
+if __name__ == '__main__':
+    main()
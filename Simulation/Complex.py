@@ -0,0 +1,244 @@
+from bisect import bisect_left
+from collections import defaultdict
+
+import gudhi
+
+from SpatialIndex import SpatialGrid
+
+
+def _insert_sorted(keys: list, items: list, key: tuple, item: tuple):
+    idx = bisect_left(keys, key)
+    keys.insert(idx, key)
+    items.insert(idx, item)
+
+
+def _remove_sorted(keys: list, items: list, key: tuple):
+    idx = bisect_left(keys, key)
+    del keys[idx]
+    del items[idx]
+
+
+class SimplexView:
+    """
+    Read-only view of the simplices of one dimension, in filtration order, with O(1) membership checks: a live
+    ordered set kept up to date by IncrementalRipsComplex.
+    """
+
+    def __init__(self, ordered: list, members) -> None:
+        self._ordered = ordered
+        self._members = members
+
+    def __iter__(self):
+        return iter(self._ordered)
+
+    def __len__(self) -> int:
+        return len(self._ordered)
+
+    def __contains__(self, simplex) -> bool:
+        return simplex in self._members
+
+    def keys(self):
+        """The simplices as a set-like object (no order), for set operations"""
+        return self._members
+
+
+class IncrementalRipsComplex:
+    """
+    2-skeleton of the Rips complex of the robots, kept up to date as robots move or are added.
+
+    Only the 1- and 2-simplices touching robots passed to update() are recomputed. Simplices are sorted vertex tuples,
+    exposed in the same filtration order gudhi's simplex_tree.get_filtration() yields them: increasing filtration value (the
+    longest edge), ties broken by the reversed vertex list.
+
+    1-simplices can be blocked (e.g. robots that cannot see each other): a blocked 1-simplex and every 2-simplex
+    that contains it are left out of one_simplices and two_simplices, but are still part of the Rips complex.
+
+    simplices ({dimension: SimplexView}) and visible_adjacency (robot -> {neighbor: None}, neighbors in the filtration
+    order of the 1-simplices joining them) only hold the simplices that are not blocked, and are updated in place;
+    visible_adjacency once sort_visible_adjacency() is called after a batch of update() and set_blocked().
+    """
+
+    def __init__(self, points: list[list[float]], max_edge_length: float, index: SpatialGrid) -> None:
+        self.points = points
+        self.max_edge_length = max_edge_length
+        self.index = index
+
+        self.adjacency = defaultdict(dict)  # robot -> {neighbor: edge length}
+        self.edge_keys, self.triangle_keys = {}, {}
+        self.blocked = set()
+        self.visible_edges, self.visible_triangles = set(), set()
+        self.visible_adjacency = defaultdict(dict)
+        self._unsorted = set()  # robots whose visible neighbors changed since the last sort_visible_adjacency()
+        self._changed_edges = set()  # 1-simplices shown or hidden since the last pop_changed_edges()
+
+        # Filtration ordered simplices (and their sort keys) that are not blocked
+        self.zero_simplices, self.one_simplices, self.two_simplices = [], [], []
+        self._one_keys, self._two_keys = [], []
+        self._zero_members = set()
+        self.simplices = {0: SimplexView(self.zero_simplices, self._zero_members),
+                          1: SimplexView(self.one_simplices, self.visible_edges),
+                          2: SimplexView(self.two_simplices, self.visible_triangles)}
+
+    def update(self, changed: set[int]) -> set[tuple[int, int]]:
+        """
+        Recompute the simplices of the robots in changed (moved or newly added).
+        Returns the 1-simplices that were removed, added or re-added.
+        """
+        for v in range(len(self.zero_simplices), len(self.points)):
+            self.zero_simplices.append((v,))
+            self._zero_members.add((v,))
+
+        touched = set()
+        for v in changed:
+            for u in list(self.adjacency[v]):
+                edge = (u, v) if u < v else (v, u)
+                self._remove_edge(edge)
+                touched.add(edge)
+
+        added = []
+        for v in changed:
+            for u, length in self.index.neighbors(self.points[v], self.max_edge_length).items():
+                if u == v:
+                    continue
+                edge = (u, v) if u < v else (v, u)
+                if edge not in self.edge_keys:
+                    self._add_edge(edge, length)
+                    added.append(edge)
+                    touched.add(edge)
+
+        for i, j in added:
+            for k in self._common_neighbors(i, j):
+                triangle = tuple(sorted([i, j, k]))
+                if triangle not in self.triangle_keys:
+                    self._add_triangle(triangle)
+
+        return touched
+
+    def set_blocked(self, edge: tuple[int, int], blocked: bool):
+        if blocked == (edge in self.blocked):
+            return
+
+        i, j = edge
+        if blocked:
+            self.blocked.add(edge)
+            self._hide_edge(edge)
+            for k in self._common_neighbors(i, j):
+                triangle = tuple(sorted([i, j, k]))
+                if triangle in self.visible_triangles:
+                    self._hide_triangle(triangle)
+        else:
+            self.blocked.remove(edge)
+            self._show_edge(edge)
+            for k in self._common_neighbors(i, j):
+                triangle = tuple(sorted([i, j, k]))
+                if self._is_triangle_visible(triangle):
+                    self._show_triangle(triangle)
+
+    def sort_visible_adjacency(self):
+        """Update visible_adjacency with the 1-simplices shown or hidden since the last call"""
+        for v in self._unsorted:
+            # Neighbors of v joined by a 1-simplex that is not blocked, in filtration order
+            neighbors = [u for u in self.adjacency[v] if ((u, v) if u < v else (v, u)) in self.visible_edges]
+            if neighbors:
+                self.visible_adjacency[v] = dict.fromkeys(
+                    sorted(neighbors, key=lambda u: self.edge_keys[(u, v) if u < v else (v, u)]))
+            else:
+                self.visible_adjacency.pop(v, None)
+        self._unsorted = set()
+
+    def pop_changed_edges(self) -> set[tuple[int, int]]:
+        """1-simplices that were shown or hidden (added, removed, blocked or unblocked) since the last call"""
+        changed_edges, self._changed_edges = self._changed_edges, set()
+        return changed_edges
+
+    def neighbors_in_filtration_order(self, v: int) -> list[int]:
+        """Neighbors of v in the filtration order of the 1-simplices joining them to v."""
+        return sorted(self.adjacency[v], key=lambda u: self.edge_keys[(u, v) if u < v else (v, u)])
+
+    def edges_of(self, v: int) -> list[tuple[int, int]]:
+        return [(u, v) if u < v else (v, u) for u in self.adjacency[v]]
+
+    def verify(self):
+        """Check the complex against a gudhi.RipsComplex built from scratch. Slow, meant for debugging."""
+        simplex_tree = gudhi.RipsComplex(points=list(self.points), max_edge_length=self.max_edge_length) \
+            .create_simplex_tree(max_dimension=2)
+        simplices = {0: [], 1: [], 2: []}
+        for simplex, _ in simplex_tree.get_filtration():
+            simplices[len(simplex) - 1].append(tuple(simplex))
+
+        assert simplices[0] == self.zero_simplices
+        assert simplices[1] == sorted(self.edge_keys, key=self.edge_keys.get)
+        assert simplices[2] == sorted(self.triangle_keys, key=self.triangle_keys.get)
+
+        self.sort_visible_adjacency()
+        visible_adjacency = defaultdict(dict)
+        for i, j in self.one_simplices:
+            visible_adjacency[i][j] = None
+            visible_adjacency[j][i] = None
+        assert {v: list(neighbors) for v, neighbors in visible_adjacency.items()} == \
+               {v: list(neighbors) for v, neighbors in self.visible_adjacency.items() if neighbors}
+        assert self.visible_edges == set(self.one_simplices)
+
+    def _common_neighbors(self, i: int, j: int) -> list[int]:
+        a, b = self.adjacency[i], self.adjacency[j]
+        if len(a) > len(b):
+            a, b = b, a
+        return [k for k in a if k in b]
+
+    def _add_edge(self, edge: tuple[int, int], length: float):
+        i, j = edge
+        self.adjacency[i][j] = length
+        self.adjacency[j][i] = length
+        self.edge_keys[edge] = (length, j, i)
+        self._show_edge(edge)
+
+    def _remove_edge(self, edge: tuple[int, int]):
+        i, j = edge
+        for k in self._common_neighbors(i, j):
+            self._remove_triangle(tuple(sorted([i, j, k])))
+
+        if edge in self.blocked:
+            self.blocked.remove(edge)
+        else:
+            self._hide_edge(edge)
+        del self.adjacency[i][j]
+        del self.adjacency[j][i]
+        del self.edge_keys[edge]
+
+    def _show_edge(self, edge: tuple[int, int]):
+        self.visible_edges.add(edge)
+        _insert_sorted(self._one_keys, self.one_simplices, self.edge_keys[edge], edge)
+        self._unsorted.update(edge)
+        self._changed_edges.add(edge)
+
+    def _hide_edge(self, edge: tuple[int, int]):
+        self.visible_edges.remove(edge)
+        _remove_sorted(self._one_keys, self.one_simplices, self.edge_keys[edge])
+        self._unsorted.update(edge)
+        self._changed_edges.add(edge)
+
+    def _add_triangle(self, triangle: tuple[int, int, int]):
+        i, j, k = triangle
+        filtration = max(self.adjacency[i][j], self.adjacency[i][k], self.adjacency[j][k])
+        self.triangle_keys[triangle] = (filtration, k, j, i)
+        if self._is_triangle_visible(triangle):
+            self._show_triangle(triangle)
+
+    def _remove_triangle(self, triangle: tuple[int, int, int]):
+        if triangle not in self.triangle_keys:
+            return
+        if triangle in self.visible_triangles:
+            self._hide_triangle(triangle)
+        del self.triangle_keys[triangle]
+
+    def _is_triangle_visible(self, triangle: tuple[int, int, int]) -> bool:
+        i, j, k = triangle
+        return (i, j) not in self.blocked and (i, k) not in self.blocked and (j, k) not in self.blocked
+
+    def _show_triangle(self, triangle: tuple[int, int, int]):
+        self.visible_triangles.add(triangle)
+        _insert_sorted(self._two_keys, self.two_simplices, self.triangle_keys[triangle], triangle)
+
+    def _hide_triangle(self, triangle: tuple[int, int, int]):
+        self.visible_triangles.remove(triangle)
+        _remove_sorted(self._two_keys, self.two_simplices, self.triangle_keys[triangle])
@@ -1,23 +1,46 @@
+import itertools
 import math
+import pickle
+import random
+import time
 from collections import defaultdict
 from pathlib import Path
 
-import gudhi
-import yaml
+import numpy as np
 
-from Utils import (FenceSubcomplex, Map, distance,
-                   ensure_valid_deploy_position, filter_exceptions,
-                   get_deployment_absolute_position, get_deployment_angle,
-                   get_graph, get_one_simplex_uncov, get_pair_combinations,
-                   is_obstacle_simplex, lazy_dijkstra, point_inside_line)
+from Complex import IncrementalRipsComplex
+from Fence import IncrementalFenceSubcomplex
+from MapCache import load_catalog, load_clearance_field
+from Profiling import NullProfiler
+from RobotStore import RobotStore
+from ShortestPath import IncrementalShortestPathTree
+from SpatialIndex import SpatialGrid
+from Utils import Map, ensure_valid_deploy_position, get_edge_weights, get_obstructed_one_simplices
 
 
 class Controller:
     def __init__(self, config_path: str, sim_id: str) -> None:
-        with open(Path(__file__).parent / config_path, 'r') as f:
-            config = yaml.safe_load(f.read())[sim_id]
+        # The parsed config file is cached, see MapCache
+        config = load_catalog(Path(__file__).parent / config_path)[sim_id]
+        self._setup(config)
+
+    @classmethod
+    def from_config(cls, config: dict, sim_map: Map = None) -> 'Controller':
+        """
+        Controller for a simulation given as a dict, laid out like the entries of config.yaml. sim_map, when given, is
+        used instead of building the map of the config (whose obstacles can then be left out). Controllers only read
+        their map, so one map can be shared by several of them.
+        """
+        controller = cls.__new__(cls)
+        controller._setup(config, sim_map)
+        return controller
+
+    def _setup(self, config: dict, sim_map: Map = None):
         self.is_full_covered = False
-        self.map = Map(config['map']['boundary'], config['map']['obstacles'])
+        self.iterations = 0
+        self.map = sim_map if sim_map is not None else Map(config['map']['boundary'], config['map']['obstacles'])
+        if self.map.clearance is None:
+            self.map.clearance = load_clearance_field(self.map)
         self.entrypoint = config['map']['entrypoint']
         self.robot_radius = config['robot_radius']
         self.sigma = config['sigma']
@@ -25,180 +48,208 @@ class Controller:
         # error in measurement of bearings to neighbors, needed so that it doesn't falsely classify 2-Rips complex
         # with pi/3 angle as obstacle
         self.beta = config['beta']
+        # robots pushed per iteration, along vertex-disjoint skeleton paths
+        self.pushes_per_iteration = config.get('pushes_per_iteration', 1)
 
-        self.robots, self.skeleton_path = [], []
+        self.robots, self.skeleton_path = RobotStore(), []
+        self.pushed_paths = []
         self.fence_subcomplex = None
-        self.robot_is_obstacle = defaultdict(bool)
+        # Optional, anything with an update_plot() method (see Visualization.Plot)
+        self.plot = None
+        # Optional, anything with a record(controller) method (see Recording.Recorder)
+        self.recorder = None
+        # Accumulated wall time in seconds of each phase of run_iter
+        self.phase_times = defaultdict(float)
+        # Replaced by Profiling.Profiler.attach() for detailed measurements
+        self.profiler = NullProfiler()
+
+        # Rips complex is only recomputed around the robots that moved or were added since the last iteration
+        max_edge_length = self.robot_radius + 0.05
+        self.robot_index = SpatialGrid(self.robots, cell_size=max_edge_length)
+        self.complex = IncrementalRipsComplex(self.robots, max_edge_length, self.robot_index)
+        # Live views of the complex (ordered sets: O(1) membership checks, iteration in filtration order), updated in
+        # place by _update_simplices
+        self.simplices = self.complex.simplices
+        self.adjacency = self.complex.visible_adjacency
+        self._moved_robots = set()
+        # Robots that moved and 1-simplices shown or hidden in the last _update_simplices
+        self._changed_robots, self._changed_one_simplices = set(), set()
+        # Robots whose obstacle flag was set since the last skeleton path update
+        self._flagged_robots = set()
+        self._overlapping_neighbors = {}
+        self._obstructed_by_obstacle = {}
+        # Fence subcomplex is only recomputed around the changed 1-simplices, verify_fence_subcomplex checks it against a
+        # full recompute every iteration (slow, for debugging)
+        self.incremental_fence = IncrementalFenceSubcomplex(self.beta, self.robot_radius)
+        self.verify_fence_subcomplex = config.get('verify_fence_subcomplex', False)
+        # Skeleton paths come from a shortest path tree that is repaired, not recomputed, every iteration
+        self.shortest_path_tree = IncrementalShortestPathTree()
 
         # Deploy first robot, assuming entrypoint is a valid position!
-        self.robots.append(self.entrypoint)
+        self._add_robot(self.entrypoint)
         # Deploy second robot in an angle of pi/3 of the first one
         second_robot_deploy_position = [[self.entrypoint[0] + self.robot_radius / 2,
                                         self.entrypoint[1] + math.sin(math.pi / 3) * self.robot_radius]]
-        pos, is_obstacle = ensure_valid_deploy_position(self.map, self.robots, self.entrypoint, second_robot_deploy_position, self.sigma)
-        self.robots.append(pos)
+        pos, is_obstacle = ensure_valid_deploy_position(self.map, self.robot_index, self.entrypoint, second_robot_deploy_position, self.sigma)
+        self._add_robot(pos)
         if is_obstacle:
             self.robot_is_obstacle[1] = True
+            self._flagged_robots.add(1)
+
+        self._run_phase('simplices', self._update_simplices)
+        self._run_phase('fence_subcomplex', self._update_fence_subcomplex)
+        self._run_phase('skeleton_path', self._update_skeleton_path)
+
+    def save_checkpoint(self, path: str):
+        """
+        Save the whole state of the simulation (including the incremental structures and the random generators) to
+        path, to continue it later with load_checkpoint. plot, recorder and profiler are not saved.
+        """
+        checkpoint = {'controller': self, 'random': random.getstate(), 'numpy_random': np.random.get_state()}
+        with open(path, 'wb') as f:
+            pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load_checkpoint(cls, path: str, restore_random: bool = True) -> 'Controller':
+        with open(path, 'rb') as f:
+            checkpoint = pickle.load(f)
+        if restore_random:
+            random.setstate(checkpoint['random'])
+            np.random.set_state(checkpoint['numpy_random'])
+        controller = checkpoint['controller']
+        controller.map.clearance = load_clearance_field(controller.map)
+        return controller
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Views and hooks belong to the running process
+        state.update(plot=None, recorder=None, profiler=NullProfiler())
+        return state
 
-        self._update_simplices()
-        self._update_fence_subcomplex()
-        self._update_skeleton_path()
+    @property
+    def robot_is_obstacle(self) -> np.ndarray:
+        """Whether each robot is in contact with an obstacle, a view of the robot store"""
+        return self.robots.is_obstacle
+
+    def _run_phase(self, name: str, phase):
+        start = time.perf_counter()
+        with self.profiler.phase(name):
+            phase()
+        self.phase_times[name] += time.perf_counter() - start
+
+    def _add_robot(self, position: list[float]):
+        self.robots.append(position)
+        self.robot_index.add(len(self.robots) - 1)
+        self._moved_robots.add(len(self.robots) - 1)
+
+    def _move_robot(self, robot: int, position: list[float]):
+        self.robots[robot] = position
+        self.robot_index.move(robot)
+        self._moved_robots.add(robot)
 
     def _update_simplices(self):
+        touched_one_simplices = self.complex.update(self._moved_robots)
+
+        # Overlaps of a robot change when it or any of its (old or new) neighbors moved
+        dirty_robots = set(self._moved_robots)
+        candidates = []
+        for i, j in touched_one_simplices:
+            dirty_robots.add(i)
+            dirty_robots.add(j)
+            if j not in self.complex.adjacency[i]:
+                self._obstructed_by_obstacle.pop((i, j), None)
+            else:
+                candidates.append((i, j))
+
+        # Check if one-simplices cross an obstacle(robots cannot see each other), all candidates at once
+        if candidates:
+            candidate_array = np.array(candidates)
+            starts = self.robots.positions[candidate_array[:, 0]]
+            ends = self.robots.positions[candidate_array[:, 1]]
+            obstructed = get_obstructed_one_simplices(starts, ends, self.map.obstacle_index)
+            self._obstructed_by_obstacle.update(zip(candidates, obstructed.tolist()))
+
+        for i in dirty_robots:
+            self._overlapping_neighbors[i] = self._get_overlapping_neighbors(i)
+
+        for i in dirty_robots:
+            for one_simplex in self.complex.edges_of(i):
+                self.complex.set_blocked(one_simplex, self._obstructed_by_obstacle[one_simplex] or
+                                         one_simplex[1] in self._overlapping_neighbors[one_simplex[0]])
+
+        # self.adjacency is a view of the complex
+        self.complex.sort_visible_adjacency()
+
+        self._changed_robots, self._moved_robots = self._moved_robots, set()
+        self._changed_one_simplices = self.complex.pop_changed_edges()
+
+    def _get_overlapping_neighbors(self, i: int) -> set[int]:
+        """
+        Check if one-simplices overlap (if 3 robots are aligned the middle one is acting as an obstacle so that the
+        ones on the ends can't see each other). Returns the neighbors of i hidden behind another neighbor.
+        """
         def _get_angle(coord1: list[float, float], coord2: list[float, float]):
             x1, y1 = coord1
             x2, y2 = coord2
             return math.atan2(y2 - y1, x2 - x1)
-        
-        self.simplices = {0: [], 1: [], 2: []}
-        rips_complex = gudhi.RipsComplex(points=self.robots, max_edge_length=self.robot_radius + 0.05)
-        simplex_tree = rips_complex.create_simplex_tree(max_dimension=2)
-
-        one_simplex_obstructed = []
-        two_simplex_to_add = []
-
-        one_simplices = [simplex for simplex, _ in simplex_tree.get_filtration() if len(simplex) - 1 == 1]
-        neighboors = defaultdict(dict)
-        for i, j in one_simplices:
-            neighboors[i][j] = {
-                'angle'     : _get_angle(self.robots[i], self.robots[j]),
-                'overlap'   : False
-            }
-            neighboors[j][i] = {
-                'angle'     : _get_angle(self.robots[j], self.robots[i]),
-                'overlap'   : False
-            }
-
-        # Check if one-simplices overlap (if 3 robots are aligned the middle one is acting as an obstacle so that the ones on the ends can't see each other)
+
         # TODO: Add a robot radius of overlap because robot is not a dot.
         overlap_angle = 0.1
-        for i, i_neighboors in neighboors.items():
-            for n1, n2 in get_pair_combinations(list(i_neighboors.keys())):
-                if abs(neighboors[i][n1]['angle'] - neighboors[i][n2]['angle']) <= overlap_angle:
-                    if distance(self.robots[i], self.robots[n1]) > distance(self.robots[i], self.robots[n2]):
-                        neighboors[i][n1]['overlap'] = True
-                    else:
-                        neighboors[i][n2]['overlap'] = True
-
-        for simplex, _ in simplex_tree.get_filtration():
-            size = len(simplex) - 1
-            if size == 1 and self._check_if_simplex_is_obstructed(simplex, neighboors):
-                one_simplex_obstructed.append(simplex)
-            elif size == 2:
-                two_simplex_to_add.append(simplex)
-            else:
-                self.simplices[size].append(simplex)
-
-        # Separately adding two_simplex that doesn't have obstruction
-        if one_simplex_obstructed:
-            for two_simplex in two_simplex_to_add:
-                for one_simplex in one_simplex_obstructed:
-                    if len([x for x in two_simplex if x in one_simplex]) == 2:
-                        break
-                else:
-                    self.simplices[2].append(two_simplex)
-        else:
-            self.simplices[2] = two_simplex_to_add
+        neighbors = self.complex.neighbors_in_filtration_order(i)
+        rank = {n: r for r, n in enumerate(neighbors)}
+        robot = self.robots[i]
+        angles = {n: _get_angle(robot, coord) for n, coord in zip(neighbors, self.robots.positions[neighbors].tolist())}
+        lengths = self.complex.adjacency[i]
 
+        # Sweep the neighbors sorted by bearing, only pairs less than overlap_angle apart are compared. Bearings are
+        # compared as they come from atan2, so neighbors on each side of the -pi/pi cut don't overlap.
+        by_angle = sorted(neighbors, key=angles.get)
+        overlapping = set()
+        for idx, n1 in enumerate(by_angle):
+            idx_2 = idx + 1
+            while idx_2 < len(by_angle) and angles[by_angle[idx_2]] - angles[n1] <= overlap_angle:
+                n2 = by_angle[idx_2]
+                # The farthest neighbor is hidden, on ties the one whose 1-simplex comes last in the filtration
+                first, second = (n1, n2) if rank[n1] < rank[n2] else (n2, n1)
+                overlapping.add(first if lengths[first] > lengths[second] else second)
+                idx_2 += 1
+        return overlapping
 
     def point_inside_line(px, py, ax, ay, bx, by):
         return (ax <= px <= bx or bx <= px <= ax) and (by <= py <= ay or ay <= py <= by)
 
-    def _check_if_simplex_is_obstructed(self, simplex: list[int], neighboors: list):
-        # Check if one-simplices overlap
-        i, j = simplex
-        if neighboors[i][j]['overlap'] == True:
-            return True
-        
-        # Check if one-simplices cross an obstacle(robots cannot see each other)
-        robot_1, robot_2 = simplex
-
-        robot_x1, robot_y1 = self.robots[robot_1]
-        robot_x2, robot_y2 = self.robots[robot_2]
-
-        # Finding line equation : y = ax + b
-        a_den = robot_x2 - robot_x1
-        if a_den != 0:
-            a = (robot_y2 - robot_y1) / a_den
-            b = robot_y1 - a * robot_x1
-
-        for (obs_x1, obs_y1), (obs_x2, obs_y2) in self.map.obstacles:
-            if a_den == 0:
-                # two robots are vertically aligned
-                if obs_x1 <= robot_x1 <= obs_x2 and point_inside_line(robot_x1, obs_y1, robot_x1, robot_y1,
-                                                                      robot_x2, robot_y2):
-                    return True
-            else:
-                y1 = a * obs_x1 + b
-                if obs_y1 <= y1 <= obs_y2 and point_inside_line(obs_x1, y1, robot_x1, robot_y1, robot_x2,
-                                                                robot_y2):
-                    return True
-                else:
-                    y2 = a * obs_x2 + b
-                    if obs_y1 <= y2 <= obs_y2 and point_inside_line(obs_x2, y2, robot_x1, robot_y1, robot_x2,
-                                                                    robot_y2):
-                        return True
-                    else:
-                        if a == 0:
-                            # two robots horizontally aligned
-                            if obs_y1 <= robot_y1 <= obs_y2 and point_inside_line(obs_x1, robot_y1, robot_x1,
-                                                                                  robot_y1, robot_x2, robot_y2):
-                                return True
-                        else:
-                            x1 = (obs_y1 - b) / a
-                            if obs_x1 <= x1 <= obs_x2 and point_inside_line(x1, obs_y1, robot_x1, robot_y1,
-                                                                            robot_x2, robot_y2):
-                                return True
-                            else:
-                                x2 = (obs_y2 - b) / a
-                                if obs_x1 <= x2 <= obs_x2 and point_inside_line(x2, obs_y2, robot_x1, robot_y1,
-                                                                                robot_x2, robot_y2):
-                                    return True
-        return False
-
     def _update_fence_subcomplex(self):
         """
             1. Filter 1 simplices (exception set)
             2. For one simplex, compute theta sign for all two simplices neighbors
             If all angles have the same sign -> the one simplex belongs to the fence subcomplex
             3. Classify the fence simplices in obstacle or frontier set
+        Only the 1-simplices within two hops of the 1-simplices shown or hidden by _update_simplices and of the
+        flagged robots are recomputed, see Fence.IncrementalFenceSubcomplex.
         """
-        obstacle_simplices, frontier_simplices = [], []
-        self.deployment_positions = defaultdict(list)
-        self.exception_one_simplices = []
-        possible_exception_one_simplices, normal_one_simplices, normal_two_simplices = filter_exceptions(self.robots, self.simplices)
-        for one_simplex in self.simplices[1]:
-            i, j = one_simplex
-            uncov = get_one_simplex_uncov(self.robots, one_simplex, normal_two_simplices)
-            if uncov:
-                if one_simplex in possible_exception_one_simplices:
-                    self.exception_one_simplices.append(one_simplex)
-                    continue
-
-                theta_i_j_new, theta_j_i_new = get_deployment_angle(obstacle_simplices, self.robots, one_simplex,
-                                                                    normal_one_simplices, uncov, self.beta)
-
-                if is_obstacle_simplex(one_simplex, self.robot_is_obstacle):
-                    obstacle_simplices.append(one_simplex)
-                elif one_simplex in obstacle_simplices:
-                    pass  # Already added simplex to obstacles on get_deployment_angle
-                else:
-                    frontier_simplices.append(one_simplex)
-
-                    # Only appending deployment positions for frontier robots
-                    for theta in theta_i_j_new:
-                        self.deployment_positions[i].append(
-                            get_deployment_absolute_position(self.robots[i], self.robots[j], theta, self.robot_radius))
-                    for theta in theta_j_i_new:
-                        self.deployment_positions[j].append(
-                            get_deployment_absolute_position(self.robots[j], self.robots[i], theta, self.robot_radius))
-
-        self.fence_subcomplex = FenceSubcomplex(obstacle_simplices, frontier_simplices)
+        self.incremental_fence.update(self.robots.positions, self.complex, self.robot_is_obstacle,
+                                      self._changed_robots, self._changed_one_simplices, self._flagged_robots)
+        if self.verify_fence_subcomplex:
+            self.incremental_fence.verify()
+        self.fence_subcomplex = self.incremental_fence.fence_subcomplex
+        self.exception_one_simplices = self.incremental_fence.exception_one_simplices
+        self.deployment_positions = self.incremental_fence.deployment_positions
 
     def _update_skeleton_path(self):
-        graph = get_graph(self.simplices[1], self.fence_subcomplex, self.robot_is_obstacle)
-        dist, paths = lazy_dijkstra(graph, self.robots.index(self.entrypoint), len(self.robots))
-        frontier_robots_indices = list(set(sum(self.fence_subcomplex.frontier_simplices, [])))
+        # Only the edges whose 1-simplex was shown or hidden, whose fence class changed or that join a robot whose
+        # obstacle flag was set are passed to the shortest path tree
+        changed_one_simplices = self._changed_one_simplices | self.incremental_fence.changed_obstacle_simplices
+        for robot in self._flagged_robots:
+            changed_one_simplices.update(self.complex.edges_of(robot))
+        self._flagged_robots = set()
+        edges = {}
+        for i, j in changed_one_simplices:
+            if (i, j) in self.simplices[1]:
+                edges[(i, j)], edges[(j, i)] = get_edge_weights((i, j), self.fence_subcomplex, self.robot_is_obstacle)
+            else:
+                edges[(i, j)] = edges[(j, i)] = None
+        self.shortest_path_tree.update(edges, self.robots.index(self.entrypoint), len(self.robots))
+        frontier_robots_indices = list(set(itertools.chain.from_iterable(self.fence_subcomplex.frontier_simplices)))
         if not frontier_robots_indices:
             self.is_full_covered = True
             print("Exploration completed!")
@@ -206,42 +257,104 @@ class Controller:
         
         frontier_paths_dist = defaultdict(list)
         for f in frontier_robots_indices:
-            frontier_paths_dist[dist[f]].append(f)
+            frontier_paths_dist[self.shortest_path_tree.dist[f]].append(f)
         
         self.skeleton_paths = []
         for k in sorted(frontier_paths_dist.keys()):
-            self.skeleton_paths += [paths[f] for f in frontier_paths_dist[k]]
+            self.skeleton_paths += [self.shortest_path_tree.path(f) for f in frontier_paths_dist[k]]
         
         
     def _push_robot(self):
+        """
+        Push robots along up to pushes_per_iteration skeleton paths, tried in order of distance to the entrypoint.
+        Each path moves its frontier robot to a deploy position, the robots behind it one step forward, and a new robot
+        enters at the entrypoint to fill the last spot. The first path is the one a single push would take, through
+        the robot at the entrypoint. The next ones stop before the entrypoint robot, the new robot taking the spot of
+        the last one, and are only pushed if they are independent of the paths already pushed: no shared robot, a
+        frontier robot outside of the neighborhoods of the frontier robots already pushed (so no shared frontier
+        simplex either), and a deploy position at least robot_radius from the other deploy positions of the iteration.
+        Deploy positions were computed for the complex before any push, pushes that interact would deploy robots on
+        top of each other. When no other path qualifies only the first one is pushed.
+        With several pushes, a robot taking the spot of the one ahead of it also takes its obstacle flag, which belongs
+        to the spot, and when no path can be pushed all the frontier robots that failed are flagged. Without them the
+        extra pushes stall, while a single push keeps its original behavior: robots keep their flag, and only the last
+        frontier robot that failed is flagged.
+        """
         if not self.skeleton_paths:
-            self.robots.append(self.entrypoint)
+            self._add_robot(self.entrypoint)
             return
 
+        multi_push = self.pushes_per_iteration > 1
+        used_robots = set()
+        failed_frontiers = []
+        # Frontier robots pushed this iteration and their neighbors, and where they were deployed
+        pushed_neighborhoods = set()
+        deploy_positions = []
+        self.pushed_paths = []
         for path in self.skeleton_paths:
+            if self.pushed_paths:
+                path = path[:-1]  # the entrypoint robot was already pushed
+                if not path or used_robots.intersection(path) or \
+                        not pushed_neighborhoods.isdisjoint(self._neighborhood(path[0])):
+                    continue
             frontier, *inner_path = path
             try:
-                next_pos = self.robots[frontier]
-                self.robots[frontier], self.robot_is_obstacle[frontier] = ensure_valid_deploy_position(self.map, self.robots, self.robots[frontier], self.deployment_positions[frontier], self.sigma)
+                next_pos, next_is_obstacle = self.robots[frontier], self.robot_is_obstacle[frontier]
+                deploy_position, is_obstacle = ensure_valid_deploy_position(self.map, self.robot_index, self.robots[frontier], self.deployment_positions[frontier], self.sigma)
+                if any(math.dist(deploy_position, other) < self.robot_radius for other in deploy_positions):
+                    continue
+                self.robot_is_obstacle[frontier] = is_obstacle
+                self._flagged_robots.add(frontier)
+                self._move_robot(frontier, deploy_position)
 
+                # Each robot takes the spot of the one ahead of it, and with several pushes whether that spot touches
+                # an obstacle
                 for inner_robot in inner_path:
-                    curr_pos = self.robots[inner_robot]
-                    self.robots[inner_robot] = next_pos
-                    next_pos = curr_pos
+                    curr_pos, curr_is_obstacle = self.robots[inner_robot], self.robot_is_obstacle[inner_robot]
+                    self._move_robot(inner_robot, next_pos)
+                    if multi_push:
+                        self.robot_is_obstacle[inner_robot] = next_is_obstacle
+                        self._flagged_robots.add(inner_robot)
+                    next_pos, next_is_obstacle = curr_pos, curr_is_obstacle
 
-                self.robots.append(self.entrypoint)
+                # For the first path next_pos is the entrypoint
+                self._add_robot(next_pos)
+                if multi_push:
+                    self.robot_is_obstacle[-1] = next_is_obstacle
+                    self._flagged_robots.add(len(self.robots) - 1)
             except ValueError as e:
                 print(e, '\nTrying next available path.\n')
+                failed_frontiers.append(frontier)
             else:
-                self.skeleton_path = path + [len(self.robots) - 1]
-                break
-        else:
-            self.robot_is_obstacle[frontier] = True
+                if not self.pushed_paths:
+                    self.skeleton_path = path + [len(self.robots) - 1]
+                self.pushed_paths.append(path)
+                used_robots.update(path)
+                pushed_neighborhoods.update(self._neighborhood(frontier))
+                deploy_positions.append(deploy_position)
+                if len(self.pushed_paths) == self.pushes_per_iteration:
+                    break
+        if not self.pushed_paths:
+            # No frontier robot could be deployed, with several pushes they are all taken as obstacles (see sigma in
+            # config.yaml), a single push only flags the last one
+            if not multi_push:
+                failed_frontiers = failed_frontiers[-1:]
+            for frontier in failed_frontiers or [frontier]:
+                self.robot_is_obstacle[frontier] = True
+                self._flagged_robots.add(frontier)
+
+    def _neighborhood(self, robot: int) -> set[int]:
+        # The robot and its neighbors in the complex of this iteration, before any push
+        return {robot, *self.adjacency.get(robot, ())}
 
-            
     def run_iter(self):
-        self._update_simplices()
-        self._update_fence_subcomplex()
-        self.plot.update_plot()
-        self._update_skeleton_path()
-        self._push_robot()
+        self.iterations += 1
+        with self.profiler.iteration(self):
+            self._run_phase('simplices', self._update_simplices)
+            self._run_phase('fence_subcomplex', self._update_fence_subcomplex)
+            if self.plot is not None:
+                self._run_phase('plot', self.plot.update_plot)
+            if self.recorder is not None:
+                self._run_phase('record', lambda: self.recorder.record(self))
+            self._run_phase('skeleton_path', self._update_skeleton_path)
+            self._run_phase('push', self._push_robot)
@@ -0,0 +1,392 @@
+import bisect
+import heapq
+from collections import defaultdict
+from dataclasses import dataclass
+
+import numpy as np
+
+from Complex import IncrementalRipsComplex
+from Utils import (FenceSubcomplex, OneSimplex, filter_exceptions, get_cofaces, get_deployment_absolute_positions,
+                   get_deployment_angle, get_exception_one_simplex, get_fence_candidate_angles,
+                   get_one_simplices_uncov, is_obstacle_simplex)
+
+
+def get_fence_subcomplex(positions: np.ndarray, simplices: dict, adjacency: defaultdict[int, dict],
+                         robot_is_obstacle: np.ndarray, beta: float, robot_radius: float) -> \
+        tuple[FenceSubcomplex, set[OneSimplex], defaultdict[int, list]]:
+    """
+        1. Filter 1 simplices (exception set)
+        2. For one simplex, compute theta sign for all two simplices neighbors
+        If all angles have the same sign -> the one simplex belongs to the fence subcomplex
+        3. Classify the fence simplices in obstacle or frontier set
+    Returns the fence subcomplex, the exception 1-simplices and the deployment positions of the frontier robots.
+    """
+    obstacle_simplices, frontier_simplices = set(), {}
+    deployment_positions = defaultdict(list)
+    exception_one_simplices = set()
+    # filter_exceptions goes robot by robot, plain lists are faster to index than the robot store
+    possible_exception_one_simplices, normal_adjacency, normal_cofaces = filter_exceptions(positions.tolist(),
+                                                                                           simplices, adjacency)
+    # The angles of all the 1-simplices to their cofaces, then of the fence ones to their neighbors, are computed
+    # in one vectorized pass each
+    fence_one_simplices, fence_uncovs = [], []
+    uncovs = get_one_simplices_uncov(positions, simplices[1], normal_cofaces)
+    for one_simplex, uncov in zip(simplices[1], uncovs):
+        if uncov:
+            if one_simplex in possible_exception_one_simplices:
+                exception_one_simplices.add(one_simplex)
+                continue
+            fence_one_simplices.append(one_simplex)
+            fence_uncovs.append(uncov)
+    candidate_angles = get_fence_candidate_angles(positions, fence_one_simplices, normal_adjacency)
+
+    # Classification stays in filtration order, get_deployment_angle adds to obstacle_simplices as it goes
+    deployment_pairs, deployment_angles = [], []
+    for one_simplex, uncov, angles in zip(fence_one_simplices, fence_uncovs, candidate_angles):
+        i, j = one_simplex
+        theta_i_j_new, theta_j_i_new = get_deployment_angle(obstacle_simplices, one_simplex, normal_adjacency,
+                                                            uncov, beta, angles)
+
+        if is_obstacle_simplex(one_simplex, robot_is_obstacle):
+            obstacle_simplices.add(one_simplex)
+        elif one_simplex in obstacle_simplices:
+            pass  # Already added simplex to obstacles on get_deployment_angle
+        else:
+            frontier_simplices[one_simplex] = None
+
+            # Only appending deployment positions for frontier robots
+            deployment_pairs.extend((i, j) for _ in theta_i_j_new)
+            deployment_angles.extend(theta_i_j_new)
+            deployment_pairs.extend((j, i) for _ in theta_j_i_new)
+            deployment_angles.extend(theta_j_i_new)
+
+    absolute_positions = get_deployment_absolute_positions(positions, deployment_pairs, deployment_angles,
+                                                           robot_radius).tolist()
+    for (robot, _), position in zip(deployment_pairs, absolute_positions):
+        deployment_positions[robot].append(position)
+
+    return FenceSubcomplex(obstacle_simplices, frontier_simplices), exception_one_simplices, deployment_positions
+
+
+def _one_simplex(i: int, j: int) -> OneSimplex:
+    return (i, j) if i < j else (j, i)
+
+
+class _Rows(dict):
+    # Positions of the robots as [x, y] lists of floats, converted the first time they are looked at
+    def __init__(self, positions: np.ndarray) -> None:
+        super().__init__()
+        self.positions = positions
+
+    def __missing__(self, robot: int) -> list[float]:
+        row = self[robot] = self.positions[robot].tolist()
+        return row
+
+
+@dataclass
+class _FenceEdge:
+    # What get_fence_subcomplex computes for a 1-simplex {i, j} before classifying it
+    uncov: list
+    # Only for fence 1-simplices that are not exceptions
+    theta_i_j_new: list[float] = None
+    theta_j_i_new: list[float] = None
+    added_obstacle_simplices: set[OneSimplex] = None
+    # Only once the 1-simplex was classified as frontier
+    deployment_positions: tuple[list, list] = None
+
+
+class IncrementalFenceSubcomplex:
+    """
+    Fence subcomplex kept up to date between iterations, with the same result as get_fence_subcomplex.
+
+    Between two iterations only the robots along the pushed paths and the new robot move. update() is given them, the
+    1-simplices the complex showed or hid since the last update (every 1-simplex of a moved robot among them) and the
+    robots whose obstacle flag was set, and only redoes what depends on them:
+        - the coface lists of the 1-simplices touching a changed 1-simplex,
+        - the exception tests within two hops of a changed 1-simplex. The test of {i, j} looks at i, j, its first
+          2-simplex {i, j, k} and the neighbors of k, once the exceptions found by the tests before it (in filtration
+          order) are removed. Tests are redone in filtration order, along with the later ones looking at an exception
+          whose first finder changed,
+        - the normal adjacency and cofaces (without the exceptions), then the uncov and deployment angles of the
+          1-simplices touching a robot whose normal 1-simplices changed,
+        - the class of the 1-simplices whose inputs changed: a fence 1-simplex is an obstacle simplex when both its
+          robots are obstacles, or when get_deployment_angle added it for a fence 1-simplex up to it in filtration
+          order, and which fence 1-simplices added each 1-simplex is kept.
+    So an update costs as much as the region around the changes, not as much as the swarm.
+    """
+
+    def __init__(self, beta: float, robot_radius: float) -> None:
+        self.beta = beta
+        self.robot_radius = robot_radius
+
+        self.fence_subcomplex = FenceSubcomplex(set(), {})
+        self.exception_one_simplices = set()
+        # 1-simplices that became or stopped being obstacle simplices in the last update
+        self.changed_obstacle_simplices = set()
+        self.deployment_positions = defaultdict(list)
+
+        # one_simplex -> third robot of each of its 2-simplices, in filtration order
+        self._cofaces = {}
+        # one_simplex -> (k, k_neighbors, exception) of its exception test, for the 1-simplices that were tested
+        self._tests = {}
+        # exception -> 1-simplices whose test found it, and the filtration key of the first one
+        self._testers = {}
+        self._found_at = {}
+        # Adjacency and cofaces without the exceptions
+        self._normal_adjacency = defaultdict(dict)
+        self._normal_cofaces = {}
+        self._edges: dict[OneSimplex, _FenceEdge] = {}
+        # one_simplex -> fence 1-simplices whose get_deployment_angle added it to the obstacle simplices
+        self._added_by = {}
+        # (sort key, one_simplex) of the frontier simplices in filtration order, and the keys they were sorted by
+        self._frontier = []
+        self._frontier_keys = {}
+        # Inputs of the last update, for verify()
+        self._inputs = None
+
+    def update(self, positions: np.ndarray, complex: IncrementalRipsComplex, robot_is_obstacle: np.ndarray,
+               moved: set[int], changed_one_simplices: set[OneSimplex], flagged: set[int]):
+        """
+        Update the fence subcomplex of complex (see get_fence_subcomplex) after the robots in moved moved or were
+        added, the 1-simplices in changed_one_simplices were shown or hidden (see
+        IncrementalRipsComplex.pop_changed_edges) and the obstacle flag of the robots in flagged was set.
+        """
+        adjacency = complex.visible_adjacency
+        self._inputs = (positions, complex.simplices, adjacency, robot_is_obstacle)
+        changed_robots = set(moved).union(*changed_one_simplices)
+        removed = [one_simplex for one_simplex in changed_one_simplices if one_simplex not in complex.simplices[1]]
+
+        # A 2-simplex that changed has a changed 1-simplex, so only the 1-simplices touching one get new cofaces
+        for one_simplex in removed:
+            self._cofaces.pop(one_simplex, None)
+        for i, j in self._one_simplices_of(changed_robots, adjacency):
+            self._cofaces[(i, j)] = sorted([k for k in adjacency[i] if k in adjacency[j]],
+                                           key=lambda k: complex.triangle_keys[tuple(sorted((i, j, k)))])
+
+        changed_exceptions = self._filter_exceptions(positions, complex, moved, changed_one_simplices, changed_robots)
+
+        # Robots whose normal 1-simplices changed, the 1-simplices touching them get new cofaces and angles
+        dirty_robots = changed_robots.union(*changed_exceptions)
+        for i in dirty_robots:
+            neighbors = [j for j in adjacency.get(i, ()) if _one_simplex(i, j) not in self.exception_one_simplices]
+            if neighbors:
+                self._normal_adjacency[i] = dict.fromkeys(neighbors)
+            else:
+                self._normal_adjacency.pop(i, None)
+        dirty = self._one_simplices_of(dirty_robots, adjacency)
+        for one_simplex in removed:
+            self._normal_cofaces.pop(one_simplex, None)
+        for one_simplex in dirty:
+            i, j = one_simplex
+            if one_simplex in self.exception_one_simplices:
+                self._normal_cofaces.pop(one_simplex, None)
+            else:
+                self._normal_cofaces[one_simplex] = [
+                    k for k in self._cofaces[one_simplex] if _one_simplex(i, k) not in self.exception_one_simplices
+                    and _one_simplex(j, k) not in self.exception_one_simplices]
+
+        # The 1-simplices that get new angles, those they add to the obstacle simplices and the ones of the flagged
+        # robots are classified again
+        reclassify = set(removed).union(dirty, self._one_simplices_of(flagged, adjacency))
+        for one_simplex in removed + dirty:
+            edge = self._edges.pop(one_simplex, None)
+            for added in (edge and edge.added_obstacle_simplices) or ():
+                self._added_by[added].remove(one_simplex)
+                if not self._added_by[added]:
+                    del self._added_by[added]
+                reclassify.add(added)
+        self._compute_edges(positions, dirty, self.exception_one_simplices, self._normal_adjacency,
+                            self._normal_cofaces)
+        for one_simplex in dirty:
+            for added in self._edges[one_simplex].added_obstacle_simplices or ():
+                self._added_by.setdefault(added, set()).add(one_simplex)
+                reclassify.add(added)
+
+        self._classify(positions, complex, robot_is_obstacle, reclassify)
+
+    def verify(self):
+        """Check the last update against get_fence_subcomplex and filter_exceptions. Slow, meant for debugging."""
+        positions, simplices, adjacency, _ = self._inputs
+        fence_subcomplex, exception_one_simplices, deployment_positions = get_fence_subcomplex(
+            *self._inputs, self.beta, self.robot_radius)
+        assert fence_subcomplex.obstacle_simplices == self.fence_subcomplex.obstacle_simplices
+        assert list(fence_subcomplex.frontier_simplices) == list(self.fence_subcomplex.frontier_simplices)
+        assert exception_one_simplices == self.exception_one_simplices
+        assert {robot: positions for robot, positions in deployment_positions.items() if positions} == \
+               {robot: positions for robot, positions in self.deployment_positions.items() if positions}
+
+        _, normal_adjacency, normal_cofaces = filter_exceptions(positions.tolist(), simplices, adjacency)
+        assert {i: list(neighbors) for i, neighbors in normal_adjacency.items() if neighbors} == \
+               {i: list(neighbors) for i, neighbors in self._normal_adjacency.items() if neighbors}
+        cofaces = get_cofaces(simplices[2])
+        assert self._cofaces.keys() <= simplices[1].keys()
+        for one_simplex in simplices[1]:
+            assert cofaces.get(one_simplex, []) == self._cofaces.get(one_simplex, [])
+            assert normal_cofaces.get(one_simplex, []) == self._normal_cofaces.get(one_simplex, [])
+
+    @staticmethod
+    def _one_simplices_of(robots: set[int], adjacency: defaultdict[int, dict]) -> list[OneSimplex]:
+        # The 1-simplices touching robots, once each
+        one_simplices = {}
+        for i in robots:
+            for j in adjacency.get(i, ()):
+                one_simplices[_one_simplex(i, j)] = None
+        return list(one_simplices)
+
+    def _filter_exceptions(self, positions: np.ndarray, complex: IncrementalRipsComplex, moved: set[int],
+                           changed_one_simplices: set[OneSimplex], changed_robots: set[int]) -> set[OneSimplex]:
+        # Redo the exception tests whose inputs changed, in filtration order, see filter_exceptions. Returns the
+        # 1-simplices that became or stopped being exceptions.
+        adjacency, edge_keys, found_at = complex.visible_adjacency, complex.edge_keys, self._found_at
+        robots = _Rows(positions)
+        queue, queued, found = [], set(), set()
+
+        def schedule(around: set[int], after: tuple = None):
+            # The tests that look at the robots in around: the ones of their 1-simplices, and the ones whose k can be
+            # one of them. Tests up to after already saw the change.
+            for v in around:
+                for u in adjacency.get(v, ()):
+                    one_simplex = _one_simplex(u, v)
+                    for other in [one_simplex] + [_one_simplex(u, w) for w in self._cofaces.get(one_simplex, ())]:
+                        if other not in queued and (after is None or edge_keys[other] > after):
+                            queued.add(other)
+                            heapq.heappush(queue, (edge_keys[other], other))
+
+        def set_tester(exception: OneSimplex, one_simplex: OneSimplex, is_tester: bool) -> bool:
+            # Returns whether the first test that found exception changed
+            testers = self._testers.setdefault(exception, set())
+            if is_tester:
+                testers.add(one_simplex)
+            else:
+                testers.discard(one_simplex)
+            first = found_at.pop(exception, None)
+            if testers:
+                found_at[exception] = min(edge_keys[tester] for tester in testers)
+            else:
+                del self._testers[exception]
+            found.add(exception)
+            return found_at.get(exception) != first
+
+        def set_test(one_simplex: OneSimplex, test: tuple, key: tuple):
+            old_test = self._tests.pop(one_simplex, None)
+            if test is not None:
+                self._tests[one_simplex] = test
+            old_exception, exception = old_test and old_test[2], test and test[2]
+            if old_exception == exception:
+                return
+            for exception, is_tester in [(old_exception, False), (exception, True)]:
+                if exception is not None and set_tester(exception, one_simplex, is_tester):
+                    schedule(set(exception), key)
+
+        # Tests of the changed 1-simplices are dropped (they were removed, or their filtration value changed) before
+        # anything is looked up by filtration value
+        around = set(changed_robots)
+        for one_simplex in changed_one_simplices:
+            test = self._tests.pop(one_simplex, None)
+            if test is not None and test[2] is not None:
+                set_tester(test[2], one_simplex, False)
+                around.update(test[2])
+        schedule(around)
+
+        # found_at.get(one_simplex, key) < key: one_simplex was found by a test before the one at key
+        while queue:
+            key, one_simplex = heapq.heappop(queue)
+            i, j = one_simplex
+            test = None
+            if not found_at.get(one_simplex, key) < key:
+                # First 2-simplex left, and the neighbors of its third robot left
+                k = next((k for k in self._cofaces.get(one_simplex, ())
+                          if not found_at.get((i, k) if i < k else (k, i), key) < key
+                          and not found_at.get((j, k) if j < k else (k, j), key) < key), None)
+                if k is not None:
+                    k_neighbors = [x for x in adjacency[k] if x != i and x != j
+                                   and not found_at.get((k, x) if k < x else (x, k), key) < key]
+                    test = self._tests.get(one_simplex)
+                    if test is None or test[:2] != (k, k_neighbors) or not moved.isdisjoint((i, j, k, *k_neighbors)):
+                        test = (k, k_neighbors, get_exception_one_simplex(robots, one_simplex, k, k_neighbors))
+            set_test(one_simplex, test, key)
+
+        changed_exceptions = set()
+        for exception in found:
+            if (exception in found_at) != (exception in self.exception_one_simplices):
+                changed_exceptions.add(exception)
+                if exception in found_at:
+                    self.exception_one_simplices.add(exception)
+                else:
+                    self.exception_one_simplices.remove(exception)
+        return changed_exceptions
+
+    def _compute_edges(self, positions: np.ndarray, one_simplices: list[OneSimplex], possible_exceptions: set,
+                       normal_adjacency: defaultdict[int, dict], normal_cofaces: dict[tuple, list[int]]):
+        fence_one_simplices, fence_uncovs = [], []
+        for one_simplex, uncov in zip(one_simplices, get_one_simplices_uncov(positions, one_simplices,
+                                                                             normal_cofaces)):
+            self._edges[one_simplex] = _FenceEdge(uncov)
+            if uncov and one_simplex not in possible_exceptions:
+                fence_one_simplices.append(one_simplex)
+                fence_uncovs.append(uncov)
+
+        candidate_angles = get_fence_candidate_angles(positions, fence_one_simplices, normal_adjacency)
+        for one_simplex, uncov, angles in zip(fence_one_simplices, fence_uncovs, candidate_angles):
+            edge = self._edges[one_simplex]
+            # get_deployment_angle only adds to obstacle_simplices, the additions are kept in _added_by
+            edge.added_obstacle_simplices = set()
+            edge.theta_i_j_new, edge.theta_j_i_new = get_deployment_angle(
+                edge.added_obstacle_simplices, one_simplex, normal_adjacency, uncov, self.beta, angles)
+
+    def _classify(self, positions: np.ndarray, complex: IncrementalRipsComplex, robot_is_obstacle: np.ndarray,
+                  one_simplices: set[OneSimplex]):
+        edge_keys = complex.edge_keys
+        obstacle_simplices = self.fence_subcomplex.obstacle_simplices
+        self.changed_obstacle_simplices = set()
+        missing = []
+        for one_simplex in one_simplices:
+            key = edge_keys[one_simplex] if one_simplex in complex.simplices[1] else None
+            is_fence = key is not None and bool(self._edges[one_simplex].uncov) and \
+                one_simplex not in self.exception_one_simplices
+            is_flagged = is_fence and is_obstacle_simplex(one_simplex, robot_is_obstacle)
+            added_by = self._added_by.get(one_simplex, ())
+            if (is_flagged or bool(added_by)) != (one_simplex in obstacle_simplices):
+                if one_simplex in obstacle_simplices:
+                    obstacle_simplices.remove(one_simplex)
+                else:
+                    obstacle_simplices.add(one_simplex)
+                self.changed_obstacle_simplices.add(one_simplex)
+
+            # A frontier simplex wasn't added to the obstacle simplices by a fence 1-simplex up to it
+            old_key = self._frontier_keys.pop(one_simplex, None)
+            if old_key is not None:
+                del self._frontier[bisect.bisect_left(self._frontier, (old_key, one_simplex))]
+            if is_fence and not is_flagged and all(edge_keys[other] > key for other in added_by):
+                bisect.insort(self._frontier, (key, one_simplex))
+                self._frontier_keys[one_simplex] = key
+                if self._edges[one_simplex].deployment_positions is None:
+                    missing.append(one_simplex)
+
+        # Deployment positions of the frontier 1-simplices that don't have them yet, in one vectorized pass
+        deployment_pairs, deployment_angles = [], []
+        for i, j in missing:
+            edge = self._edges[(i, j)]
+            deployment_pairs.extend([(i, j)] * len(edge.theta_i_j_new) + [(j, i)] * len(edge.theta_j_i_new))
+            deployment_angles.extend(edge.theta_i_j_new + edge.theta_j_i_new)
+        absolute_positions = get_deployment_absolute_positions(positions, deployment_pairs, deployment_angles,
+                                                               self.robot_radius).tolist()
+        start = 0
+        for one_simplex in missing:
+            edge = self._edges[one_simplex]
+            middle = start + len(edge.theta_i_j_new)
+            end = middle + len(edge.theta_j_i_new)
+            edge.deployment_positions = (absolute_positions[start:middle], absolute_positions[middle:end])
+            start = end
+
+        # Only appending deployment positions for frontier robots
+        frontier_simplices = dict.fromkeys(one_simplex for _, one_simplex in self._frontier)
+        self.deployment_positions = defaultdict(list)
+        for i, j in frontier_simplices:
+            positions_i, positions_j = self._edges[(i, j)].deployment_positions
+            if positions_i:
+                self.deployment_positions[i].extend(positions_i)
+            if positions_j:
+                self.deployment_positions[j].extend(positions_j)
+
+        self.fence_subcomplex = FenceSubcomplex(obstacle_simplices, frontier_simplices)
@@ -0,0 +1,143 @@
+"""
+On disk cache of what doesn't need to be redone on every run: the parsed scenario catalog (config.yaml) and the
+clearance field of each map (see SpatialIndex.ClearanceField).
+
+Entries are keyed by a hash of their source (the bytes of the config file, the boundary and obstacles of the map), so
+they never go stale and runs on different maps share the cache. Clearance fields are .npy files loaded memory-mapped:
+only the pages a run looks at are read, and processes running on the same map share them through the page cache.
+
+Every generated map adds an entry, so the cache is capped at MAX_CACHE_BYTES: each load marks its entry as used
+(modification time of its files), and adding an entry removes the least recently used ones past the cap. Delete the
+cache directory to clear it.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+from SpatialIndex import ClearanceField
+from Utils import Map
+
+CACHE_DIR = Path(__file__).parent / '.map_cache'
+# Size the cache is trimmed down to when an entry is added, a 4096 x 4096 cells clearance field takes 80 MB
+MAX_CACHE_BYTES = 1 << 30
+# Part of every key, to bump when the cached data changes
+_VERSION = 1
+
+
+def map_key(sim_map: Map, resolution: float = None, max_clearance: float = 1.0) -> str:
+    description = [_VERSION, sim_map.boundary, sim_map.obstacle_array.tolist(), resolution, max_clearance]
+    return hashlib.sha256(json.dumps(description).encode()).hexdigest()[:32]
+
+
+def _write_atomic(path: Path, write):
+    # Other processes never see half written files, the last writer wins
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.chmod(tmp_path, 0o644)  # mkstemp makes files only readable by their owner
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _touch(*paths: Path):
+    # Marks an entry as used, for trim_cache
+    for path in paths:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+
+def trim_cache(cache_dir: Path = CACHE_DIR, max_bytes: int = MAX_CACHE_BYTES, keep: str = None) -> int:
+    """
+    Remove the least recently used entries of the cache until it takes at most max_bytes, except the entry keep. An
+    entry is all the files of a key, used when the last of them was. Returns the number of bytes freed.
+    """
+    entries = {}
+    for path in Path(cache_dir).iterdir():
+        if path.suffix == '.tmp':
+            continue  # being written
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue  # removed by another process
+        paths, size, last_used = entries.get(path.name.split('.')[0], ([], 0, 0))
+        entries[path.name.split('.')[0]] = (paths + [path], size + stat.st_size, max(last_used, stat.st_mtime))
+
+    total = sum(size for _, size, _ in entries.values())
+    freed = 0
+    for key, (paths, size, _) in sorted(entries.items(), key=lambda entry: entry[1][2]):
+        if total - freed <= max_bytes:
+            break
+        if key == keep:
+            continue
+        # Processes that memory-mapped the files keep their pages, the files are only unlinked
+        for path in paths:
+            try:
+                path.unlink()
+            except OSError:
+                pass  # removed by another process, or still open on Windows
+        freed += size
+    return freed
+
+
+def load_clearance_field(sim_map: Map, cache_dir: Path = CACHE_DIR, resolution: float = None,
+                         max_clearance: float = 1.0, max_bytes: int = MAX_CACHE_BYTES) -> ClearanceField:
+    """
+    Clearance field of sim_map, memory-mapped from the cache or built and added to it, the cache then being trimmed to
+    max_bytes. If the cache can't be written the field built in memory is returned.
+    """
+    key = map_key(sim_map, resolution, max_clearance)
+    clearance_path = Path(cache_dir) / f'{key}.clearance.npy'
+    free_path = Path(cache_dir) / f'{key}.free.npy'
+    origin, resolution, _ = ClearanceField.grid(sim_map.boundary, resolution)
+    try:
+        field = ClearanceField(origin, resolution, np.load(clearance_path, mmap_mode='r'),
+                               np.load(free_path, mmap_mode='r'))
+        _touch(clearance_path, free_path)
+        return field
+    except (FileNotFoundError, ValueError):
+        pass
+
+    field = ClearanceField.build(sim_map.boundary, sim_map.obstacle_array, resolution, max_clearance)
+    try:
+        _write_atomic(free_path, lambda f: np.save(f, field.free))
+        _write_atomic(clearance_path, lambda f: np.save(f, field.clearance))
+        trim_cache(cache_dir, max_bytes, keep=key)
+    except OSError:
+        return field
+    return ClearanceField(origin, resolution, np.load(clearance_path, mmap_mode='r'), np.load(free_path, mmap_mode='r'))
+
+
+def load_catalog(config_path: Path, cache_dir: Path = CACHE_DIR) -> dict:
+    """
+    Scenarios of a config file, like yaml.safe_load, from the cache when the file didn't change. The cache is JSON, so
+    reading it can't run code either; configs that JSON can't hold as they are (e.g. dates, non string keys) aren't
+    cached.
+    """
+    content = Path(config_path).read_bytes()
+    catalog_path = Path(cache_dir) / f'catalog-{hashlib.sha256(content).hexdigest()[:32]}.json'
+    try:
+        catalog = json.loads(catalog_path.read_bytes())
+        _touch(catalog_path)
+        return catalog
+    except (FileNotFoundError, ValueError):
+        pass
+
+    catalog = yaml.safe_load(content)
+    try:
+        serialized = json.dumps(catalog).encode()
+        if json.loads(serialized) == catalog:
+            _write_atomic(catalog_path, lambda f: f.write(serialized))
+    except (TypeError, ValueError, OSError):
+        pass
+    return catalog
@@ -1,4 +1,4 @@
-import copy
+import bisect
 import math
 import random
 import threading
@@ -8,15 +8,20 @@ import Utils as u
 import Wireless
 
 
-class ExceptionOpenLoop(Exception):
-    pass
-
-
 class MapBuilder(object):
     """
     A background task which consolidates the map.
     It combines dots into lines
     It declares when the map is complete.
+
+    Dots and lines are indexed by row (horizontal lines, dots by x) and by column (vertical lines, dots by y), in
+    sorted lists. Rows and columns without new bumps are already consolidated, so each consolidation only goes through
+    the rows and columns which received bumps since the previous one.
+
+    The map is complete when no dots are left and the lines form closed outlines: every end of a line is close
+    (MINFEATURESIZE) to an end of another line, an end against the middle of a line doesn't count, and every group of
+    lines linked this way has at least 3 lines. Line ends are kept in a grid of MINFEATURESIZE cells and the groups in
+    a union-find, both updated as lines are created or merged, so checking for completion doesn't walk the lines.
     """
 
     PERIOD = 1  # s, in simulated time
@@ -31,9 +36,28 @@ class MapBuilder(object):
         self.dataLock = threading.RLock()
         self.discoMap = {
             'complete': False,  # is the map complete?
-            'dots': [],  # each bump becomes a dot
-            'lines': [],  # closeby dots are aggregated into a line
         }
+        # each bump becomes a dot, {y: sorted x} and {x: sorted y}
+        self.dots = set()
+        self.dotsPerRow = {}
+        self.dotsPerCol = {}
+        # closeby dots are aggregated into a line, {y: sorted (ax, bx)} and {x: sorted (ay, by)}
+        self.linesPerRow = {}
+        self.linesPerCol = {}
+        # rows (y) and columns (x) which received bumps since the last consolidation
+        self.dirtyRows = set()
+        self.dirtyCols = set()
+        # ends of the lines, (line, 0) at (ax, ay) and (line, 1) at (bx, by), in a grid {cell: {end}}
+        self.lineEnds = {}
+        # number of ends of other lines close to each end, the ends without any are open
+        self.endLinks = {}
+        self.openEnds = set()
+        # union-find over the lines whose ends are close, with the lines of each group (by its root)
+        self.loopParent = {}
+        self.loopMembers = {}
+        self.smallLoops = 0  # groups of less than 3 lines
+        # removed lines, their groups may have split and are recomputed when needed
+        self.staleLoops = set()
 
         # schedule first housekeeping activity
         self.simEngine.schedule(self.simEngine.currentTime() + self.PERIOD, self._houseKeeping)
@@ -43,12 +67,22 @@ class MapBuilder(object):
     def notifBump(self, x, y):
 
         with self.dataLock:
-            self.discoMap['dots'] += [(x, y)]
+            if (x, y) in self.dots:
+                return
+            self.dots.add((x, y))
+            bisect.insort(self.dotsPerRow.setdefault(y, []), x)
+            bisect.insort(self.dotsPerCol.setdefault(x, []), y)
+            self.dirtyRows.add(y)
+            self.dirtyCols.add(x)
 
     def getMap(self):
 
         with self.dataLock:
-            return copy.deepcopy(self.discoMap)
+            return {
+                'complete': self.discoMap['complete'],
+                'dots': sorted(self.dots),
+                'lines': self._getLines(),
+            }
 
     # ======================== private =========================================
 
@@ -66,205 +100,234 @@ class MapBuilder(object):
 
     def _consolidateMap(self):
 
-        # result list of lines
-        res_lines = []
+        # horizontal, then vertical lines of the rows/columns with new dots
+        for ref in self.dirtyRows:
+            self._storeLines(self.linesPerRow, ref, self._consolidateRef(self.dotsPerRow.get(ref, []),
+                                                                         self.linesPerRow.get(ref, [])), True)
+        for ref in self.dirtyCols:
+            self._storeLines(self.linesPerCol, ref, self._consolidateRef(self.dotsPerCol.get(ref, []),
+                                                                         self.linesPerCol.get(ref, [])), False)
+
+        # remove dots which fall inside a line, only the lines of these rows/columns changed
+        for y in self.dirtyRows:
+            for x in [x for x in self.dotsPerRow.get(y, []) if self._isOnLines(x, self.linesPerRow.get(y, []))]:
+                self._removeDot(x, y)
+        for x in self.dirtyCols:
+            for y in [y for y in self.dotsPerCol.get(x, []) if self._isOnLines(y, self.linesPerCol.get(x, []))]:
+                self._removeDot(x, y)
+
+        self.dirtyRows = set()
+        self.dirtyCols = set()
+
+    def _consolidateRef(self, these_dots, these_lines):
+        """
+        Lines along one row or column: these_dots are the positions of its dots along it, these_lines the (start, end)
+        of its lines, both sorted. Returns the new lines of the row or column, sorted.
+        """
 
-        # remove duplicate dots
-        self.discoMap['dots'] = list(set(self.discoMap['dots']))
+        # remove dots which fall inside a line
+        points = set(v for v in these_dots if not self._isOnLines(v, these_lines))
+
+        # add vertices of all lines to the dots
+        for (a, b) in these_lines:
+            points.add(a)
+            points.add(b)
+
+        # sort dots by increasing value
+        points = sorted(points)
 
-        # horizontal
-        for direction in ['horizontal', 'vertical']:
+        # create line between close dots (a set, short lines turn into close points)
+        new_lines = set(these_lines)
+        for (v, vnext) in zip(points, points[1:]):
+            if vnext - v <= self.MINFEATURESIZE:
+                new_lines.add((v, vnext))
 
-            refs = []
-            if direction == 'horizontal':
-                refs += [y for (x, y) in self.discoMap['dots']]  # all dots
-                refs += [lay for (lax, lay, lbx, lby) in self.discoMap['lines'] if lay == lby]  # all horizontal lines
+        # join the lines that touch
+        res_lines = []
+        for (a, b) in sorted(new_lines):
+            if res_lines and res_lines[-1][1] == a:
+                res_lines[-1] = (res_lines[-1][0], b)
             else:
-                refs += [x for (x, y) in self.discoMap['dots']]  # all dots
-                refs += [lax for (lax, lay, lbx, lby) in self.discoMap['lines'] if lax == lbx]  # all vertical lines
-            refs = set(refs)
-
-            for ref in refs:
-
-                # select all the dots which are aligned at this ref
-                if direction == 'horizontal':
-                    these_dots = [x for (x, y) in self.discoMap['dots'] if y == ref]
-                else:
-                    these_dots = [y for (x, y) in self.discoMap['dots'] if x == ref]
-
-                # select the lines we already know of at this ref
-                if direction == 'horizontal':
-                    these_lines = [(lax, lay, lbx, lby) for (lax, lay, lbx, lby) in self.discoMap['lines'] if
-                                   lay == ref and lby == ref]
-                else:
-                    these_lines = [(lax, lay, lbx, lby) for (lax, lay, lbx, lby) in self.discoMap['lines'] if
-                                   lax == ref and lbx == ref]
-
-                # remove dots which fall inside a line
-                if direction == 'horizontal':
-                    these_dots = [x for (x, y) in self._removeDotsOnLines([(x, ref) for x in these_dots], these_lines)]
-                else:
-                    these_dots = [y for (x, y) in self._removeDotsOnLines([(ref, y) for y in these_dots], these_lines)]
-
-                # add vertices of all lines to the dots
-                for (lax, lay, lbx, lby) in these_lines:
-                    if direction == 'horizontal':
-                        these_dots += [lax]
-                        these_dots += [lbx]
-                    else:
-                        these_dots += [lay]
-                        these_dots += [lby]
-
-                # remove duplicates (in case dot falls on vertice of existing line)
-                these_dots = list(set(these_dots))
-
-                # sort dots by increasing value
-                these_dots = sorted(these_dots)
-
-                # create line between close dots
-                for (idx, v) in enumerate(these_dots):
-                    if idx == len(these_dots) - 1:
-                        continue
-                    vnext = these_dots[idx + 1]
-
-                    if vnext - v <= self.MINFEATURESIZE:
-
-                        if direction == 'horizontal':
-                            these_lines += [(v, ref, vnext, ref)]
-                        else:
-                            these_lines += [(ref, v, ref, vnext)]
-
-                # remove line duplicates (caused by short lines which turn into close points)
-                these_lines = list(set(these_lines))
-
-                # join the lines that touch
-                if direction == 'horizontal':
-                    these_lines = sorted(these_lines, key=lambda l: l[0])
-                else:
-                    these_lines = sorted(these_lines, key=lambda l: l[1])
-                idx = 0
-                while idx < len(these_lines) - 1:
-                    (lax, lay, lbx, lby) = these_lines[idx]
-                    (nax, nay, nbx, nby) = these_lines[idx + 1]
-                    if direction == 'horizontal':
-                        condition = (lbx == nax)
-                    else:
-                        condition = (lby == nay)
-                    if condition:
-                        these_lines[idx] = (lax, lay, nbx, nby)
-                        these_lines.pop(idx + 1)
-                    else:
-                        idx += 1
-
-                # store
-                res_lines += these_lines
-
-        # store
-        self.discoMap['lines'] = res_lines
-
-        # remove duplicate dots
-        self.discoMap['dots'] = list(set(self.discoMap['dots']))
+                res_lines += [(a, b)]
+        return res_lines
 
-        # remove dots which fall inside a line
-        self.discoMap['dots'] = self._removeDotsOnLines(self.discoMap['dots'], self.discoMap['lines'])
+    @staticmethod
+    def _isOnLines(v, lines):
+        # lines are sorted and don't overlap, only the last one starting at or before v can contain it
+        idx = bisect.bisect_right(lines, (v, math.inf)) - 1
+        return idx >= 0 and v <= lines[idx][1]
+
+    def _storeLines(self, linesPerRef, ref, lines, horizontal):
+
+        # update the line ends with the lines which changed
+        old_lines = set(linesPerRef.get(ref, []))
+        for (a, b) in old_lines.difference(lines):
+            self._removeLine((a, ref, b, ref) if horizontal else (ref, a, ref, b))
+        for (a, b) in set(lines).difference(old_lines):
+            self._addLine((a, ref, b, ref) if horizontal else (ref, a, ref, b))
+
+        if lines:
+            linesPerRef[ref] = lines
+        else:
+            linesPerRef.pop(ref, None)
+
+    def _removeDot(self, x, y):
+        if (x, y) not in self.dots:
+            return  # already removed by a line in the other direction
+        self.dots.remove((x, y))
+        for (dotsPerRef, ref, v) in [(self.dotsPerRow, y, x), (self.dotsPerCol, x, y)]:
+            these_dots = dotsPerRef[ref]
+            del these_dots[bisect.bisect_left(these_dots, v)]
+            if not these_dots:
+                del dotsPerRef[ref]
+
+    def _getLines(self):
+        # all the lines, as (ax, ay, bx, by)
+        lines = [(ax, y, bx, y) for y in sorted(self.linesPerRow) for (ax, bx) in self.linesPerRow[y]]
+        lines += [(x, ay, x, by) for x in sorted(self.linesPerCol) for (ay, by) in self.linesPerCol[x]]
+        return lines
+
+    def _addLine(self, line):
+
+        if line in self.loopParent:
+            self._splitLoops()  # the line was removed, but is still in its old group
+        self.loopParent[line] = line
+        self.loopMembers[line] = [line]
+        self.smallLoops += 1
+        for end in [(line, 0), (line, 1)]:
+            links = 0
+            for other in self._closeEnds(end):
+                links += 1
+                self._linkEnd(other, +1)
+                self._joinLoops(line, other[0])
+            self.endLinks[end] = links
+            if not links:
+                self.openEnds.add(end)
+            self.lineEnds.setdefault(self._endCell(end), set()).add(end)
+
+    def _removeLine(self, line):
+
+        for end in [(line, 0), (line, 1)]:
+            self.lineEnds[self._endCell(end)].remove(end)
+            for other in self._closeEnds(end):
+                self._linkEnd(other, -1)
+            del self.endLinks[end]
+            self.openEnds.discard(end)
+        # the group of the line may split, a union-find can't tell
+        self.staleLoops.add(line)
+
+    def _linkEnd(self, end, delta):
+        self.endLinks[end] += delta
+        if self.endLinks[end]:
+            self.openEnds.discard(end)
+        else:
+            self.openEnds.add(end)
 
     @staticmethod
-    def _removeDotsOnLines(dots, lines):
-        idx = 0
-        while idx < len(dots):
-            (dx, dy) = dots[idx]
-            removed = False
-            for (lax, lay, lbx, lby) in lines:
-                if lay == lby and lay == dy:
-                    # horizontal line, co-linear to point
-
-                    condition = lax <= dx <= lbx
-                elif lax == lbx and lax == dx:
-                    # vertical line,   co-linear to point
-
-                    condition = lay <= dy <= lby
-                else:
-                    # not co-linear to point
-                    condition = False
-                if condition:
-                    dots.pop(idx)
-                    removed = True
-                    break
-            if not removed:
-                idx += 1
-        return dots
+    def _endPoint(end):
+        (line, idx) = end
+        return line[2 * idx:2 * idx + 2]
+
+    def _endCell(self, end):
+        (x, y) = self._endPoint(end)
+        return math.floor(x / self.MINFEATURESIZE), math.floor(y / self.MINFEATURESIZE)
+
+    def _closeEnds(self, end):
+        # ends of the other lines close to end, they are in the cells around its cell
+        point = self._endPoint(end)
+        (cx, cy) = self._endCell(end)
+        for ncx in range(cx - 1, cx + 2):
+            for ncy in range(cy - 1, cy + 2):
+                for other in self.lineEnds.get((ncx, ncy), ()):
+                    if other[0] != end[0] and u.distance(point, self._endPoint(other)) <= self.MINFEATURESIZE:
+                        yield other
+
+    def _findLoop(self, line):
+        while self.loopParent[line] != line:
+            self.loopParent[line] = self.loopParent[self.loopParent[line]]
+            line = self.loopParent[line]
+        return line
+
+    def _joinLoops(self, line1, line2):
+        root1, root2 = self._findLoop(line1), self._findLoop(line2)
+        if root1 == root2:
+            return
+        members1, members2 = self.loopMembers[root1], self.loopMembers[root2]
+        if len(members1) < len(members2):
+            root1, root2, members1, members2 = root2, root1, members2, members1
+        self.smallLoops -= (len(members1) < 3) + (len(members2) < 3)
+        self.loopParent[root2] = root1
+        members1 += self.loopMembers.pop(root2)
+        self.smallLoops += len(members1) < 3
+
+    def _splitLoops(self):
+        # recompute the groups of the removed lines from the close ends of their remaining lines, the other groups
+        # can't have changed (close lines are always in the same group)
+        roots = {self._findLoop(line) for line in self.staleLoops}
+        lines = []
+        for root in roots:
+            members = self.loopMembers.pop(root)
+            self.smallLoops -= len(members) < 3
+            lines += members
+        for line in lines:
+            del self.loopParent[line]
+        lines = [line for line in lines if (line, 0) in self.endLinks]
+        for line in lines:
+            self.loopParent[line] = line
+            self.loopMembers[line] = [line]
+            self.smallLoops += 1
+        for line in lines:
+            for end in [(line, 0), (line, 1)]:
+                for other in self._closeEnds(end):
+                    self._joinLoops(line, other[0])
+        self.staleLoops = set()
 
     def _isMapComplete(self):
 
-        while True:  # "loop" only once
-
-            # map is never complete if there are dots remaining
-            if self.discoMap['dots']:
-                returnVal = False
-                break
-
-            # keep looping until no more todo lines
-            all_lines = copy.deepcopy(self.discoMap['lines'])
-            try:
-
-                while all_lines:
-                    loop = self._walkloop(all_lines, all_lines[0])
-                    for line in loop:
-                        all_lines.remove(line)
-
-            except ExceptionOpenLoop:
-                returnVal = False
-                break
-
-            # if I get here, map is complete
-            returnVal = True
-            break
-
-        return returnVal
-
-    def _walkloop(self, all_lines, start_line):
-
-        loop = []
-        loop += [start_line]
-        while True:
-            # add close line to loop
-            foundCloseLine = False
-            for line in all_lines:
-                if (self._areLinesClose(loop[-1], line)) and (line not in loop):
-                    foundCloseLine = True
-                    loop += [line]
-                    break
-
-            # abort if no next line to hop to
-            if not foundCloseLine:
-                raise ExceptionOpenLoop()
-            # success! last line in loop is close to first line
-            if len(loop) > 2 and self._areLinesClose(loop[-1], loop[0]):
-                return loop
-
-    def _areLinesClose(self, line1, line2):
-
-        (l1ax, l1ay, l1bx, l1by) = line1
-        (l2ax, l2ay, l2bx, l2by) = line2
-
-        returnVal = False
-
-        while True:  # "loop" only once
-            if u.distance((l1ax, l1ay), (l2ax, l2ay)) <= self.MINFEATURESIZE:
-                returnVal = True
-                break
-            if u.distance((l1ax, l1ay), (l2bx, l2by)) <= self.MINFEATURESIZE:
-                returnVal = True
-                break
-            if u.distance((l1bx, l1by), (l2ax, l2ay)) <= self.MINFEATURESIZE:
-                returnVal = True
-                break
-            if u.distance((l1bx, l1by), (l2bx, l2by)) <= self.MINFEATURESIZE:
-                returnVal = True
-                break
-            break
-
-        return returnVal
+        # map is never complete if there are dots remaining, or lines with an end that doesn't meet another line
+        if self.dots or self.openEnds:
+            return False
+
+        # every group of lines must be a closed loop
+        if self.staleLoops:
+            self._splitLoops()
+        return self.smallLoops == 0
+
+    def verify(self):
+        """Check the line ends and groups against a recompute from all the lines. Slow, meant for debugging."""
+        lines = self._getLines()
+        ends = [(line, idx) for line in lines for idx in [0, 1]]
+        links = {end: sum(1 for other in ends if other[0] != end[0] and
+                          u.distance(self._endPoint(end), self._endPoint(other)) <= self.MINFEATURESIZE)
+                 for end in ends}
+        assert links == self.endLinks
+        assert self.openEnds == {end for (end, n) in links.items() if not n}
+
+        # groups of lines, by a walk over the close ends
+        close = {line: {other[0] for other in ends if other[0] != line and any(
+            u.distance(self._endPoint((line, idx)), self._endPoint(other)) <= self.MINFEATURESIZE for idx in [0, 1])}
+            for line in lines}
+        groups, seen = [], set()
+        for line in lines:
+            if line in seen:
+                continue
+            group, todo = set(), [line]
+            while todo:
+                current = todo.pop()
+                if current not in group:
+                    group.add(current)
+                    todo += close[current]
+            seen |= group
+            groups += [group]
+
+        if self.staleLoops:
+            self._splitLoops()
+        assert sorted(map(sorted, self.loopMembers.values())) == sorted(map(sorted, groups))
+        loops = {}
+        for line in lines:
+            loops.setdefault(self._findLoop(line), set()).add(line)
+        assert sorted(map(sorted, groups)) == sorted(map(sorted, loops.values()))
+        assert self.smallLoops == sum(1 for group in groups if len(group) < 3)
 
 
 class DotBotsView:
@@ -0,0 +1,164 @@
+"""
+Instrumentation of Controller.run_iter: wall time of each phase, call counts of the hot helpers of Utils, simplex
+counts and tracemalloc deltas, exported as JSON lines or as a Chrome trace (chrome://tracing, ui.perfetto.dev).
+
+    profiler = Profiler(trace_memory=True)
+    profiler.attach(controller)
+    ... controller.run_iter() ...
+    profiler.detach()
+    profiler.to_chrome_trace('trace.json')
+
+Controllers start with a NullProfiler, whose hooks do nothing.
+"""
+import contextlib
+import functools
+import json
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+import Utils
+
+# Helpers of Utils whose calls are counted while a Profiler is attached
+COUNTED_FUNCTIONS = ['get_angle', 'get_angles', 'distance', 'check_obstruction_between_robots']
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+class NullProfiler:
+    """Profiler that records nothing, the default of Controller"""
+
+    def phase(self, name: str):
+        return _NULL_CONTEXT
+
+    def iteration(self, controller):
+        return _NULL_CONTEXT
+
+
+class Profiler(NullProfiler):
+    """
+    Records one event per phase and one per iteration. Iteration events also hold the counters incremented during the
+    iteration and the number of simplices at its end.
+    """
+
+    def __init__(self, trace_memory: bool = False) -> None:
+        self.trace_memory = trace_memory
+        self.events = []
+        self.counters = Counter()
+        self.iteration_number = 0
+        self._origin = time.perf_counter()
+        self._patched = []
+        self._started_tracing = False
+
+    def attach(self, controller):
+        """Profile controller and count the calls of the helpers in COUNTED_FUNCTIONS until detach()"""
+        controller.profiler = self
+        for name in COUNTED_FUNCTIONS:
+            self._patch(Utils, name, name)
+        self._patch_deploy_position(sys.modules[type(controller).__module__])
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def detach(self):
+        for module, name, function in reversed(self._patched):
+            setattr(module, name, function)
+        self._patched = []
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _patch(self, module, name: str, counter: str):
+        function = getattr(module, name)
+
+        @functools.wraps(function)
+        def counted(*args, **kwargs):
+            self.counters[counter] += 1
+            return function(*args, **kwargs)
+
+        self._patched.append((module, name, function))
+        setattr(module, name, counted)
+
+    def _patch_deploy_position(self, module):
+        # Counts the calls of ensure_valid_deploy_position, and the candidate positions it rejects for being too close
+        # to another robot as retries
+        function = module.ensure_valid_deploy_position
+
+        @functools.wraps(function)
+        def counted(sim_map, robot_index, *args, **kwargs):
+            self.counters['ensure_valid_deploy_position'] += 1
+            return function(sim_map, _RejectionCounter(robot_index, self.counters), *args, **kwargs)
+
+        self._patched.append((module, 'ensure_valid_deploy_position', function))
+        module.ensure_valid_deploy_position = counted
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start, memory = time.perf_counter(), self._memory()
+        try:
+            yield
+        finally:
+            self._record(name, 'phase', start, memory)
+
+    @contextlib.contextmanager
+    def iteration(self, controller):
+        start, memory, counters = time.perf_counter(), self._memory(), Counter(self.counters)
+        try:
+            yield
+        finally:
+            event = self._record('run_iter', 'iteration', start, memory)
+            event['counters'] = dict(self.counters - counters)
+            event['counters'].setdefault('ensure_valid_deploy_position_retries', 0)
+            event['robots'] = len(controller.robots)
+            event['simplices'] = {dim: len(simplices) for dim, simplices in controller.simplices.items()}
+            self.iteration_number += 1
+
+    def _memory(self):
+        return tracemalloc.get_traced_memory()[0] if self.trace_memory else None
+
+    def _record(self, name: str, kind: str, start: float, memory) -> dict:
+        end = time.perf_counter()
+        event = {'name': name, 'kind': kind, 'iteration': self.iteration_number,
+                 'start': start - self._origin, 'duration': end - start}
+        if self.trace_memory:
+            event['memory_delta'] = self._memory() - memory
+        self.events.append(event)
+        return event
+
+    def to_jsonl(self, path: str):
+        with open(path, 'w') as f:
+            for event in self.events:
+                f.write(json.dumps(event) + '\n')
+
+    def to_chrome_trace(self, path: str):
+        """Trace event format: a complete (X) event per phase/iteration and counter (C) tracks per iteration"""
+        trace_events = []
+        for event in self.events:
+            args = {key: value for key, value in event.items() if key not in ('name', 'start', 'duration')}
+            trace_events.append({'name': event['name'], 'cat': event['kind'], 'ph': 'X', 'pid': 0, 'tid': 0,
+                                 'ts': event['start'] * 1e6, 'dur': event['duration'] * 1e6, 'args': args})
+            if event['kind'] == 'iteration':
+                end = (event['start'] + event['duration']) * 1e6
+                trace_events.append({'name': 'simplices', 'ph': 'C', 'pid': 0, 'ts': end,
+                                     'args': {str(dim): count for dim, count in event['simplices'].items()}})
+                trace_events.append({'name': 'calls', 'ph': 'C', 'pid': 0, 'ts': end, 'args': event['counters']})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+
+
+class _RejectionCounter:
+    # Robot index as seen by ensure_valid_deploy_position: a candidate position is rejected when any_within finds a
+    # robot close to it
+    def __init__(self, robot_index, counters: Counter) -> None:
+        self._robot_index = robot_index
+        self._counters = counters
+
+    def any_within(self, point, radius: float) -> bool:
+        found = self._robot_index.any_within(point, radius)
+        if found:
+            self._counters['ensure_valid_deploy_position_retries'] += 1
+        return found
+
+    def __getattr__(self, name: str):
+        return getattr(self._robot_index, name)
@@ -0,0 +1,145 @@
+"""
+Compact recording of simulation runs, to replay them (Replay.py) without running the simulation again.
+
+A recording is a directory holding the map (map.json) and append-only chunks of iterations (chunk_*.npz). Each
+iteration is a Snapshot: what the view needs to draw it, as arrays.
+"""
+import json
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from Utils import Map
+
+# Classes of 1-simplices, edge_classes of a Snapshot are indices in this list
+EDGE_CLASSES = ['normal', 'exception', 'obstacle', 'frontier', 'skeleton']
+_EDGE_CLASS_INDEX = {name: index for index, name in enumerate(EDGE_CLASSES)}
+
+
+@dataclass
+class Snapshot:
+    iteration: int
+    robots: np.ndarray  # (n_robots, 2) positions
+    robot_is_obstacle: np.ndarray  # (n_robots,) bool
+    edges: np.ndarray  # (n_one_simplices, 2) robots of the 1-simplices
+    edge_classes: np.ndarray  # (n_one_simplices,) index in EDGE_CLASSES
+    skeleton_path: np.ndarray  # robots of the last skeleton path robots were pushed along
+
+
+def take_snapshot(controller, iteration: int = 0) -> Snapshot:
+    skeleton_path = controller.skeleton_path
+    skeleton_path_simplices = {(p1, p2) if p1 < p2 else (p2, p1) for p1, p2 in
+                               zip(skeleton_path[:-1], skeleton_path[1:])}
+    fence_subcomplex = controller.fence_subcomplex
+    edge_classes = []
+    for one_simplex in controller.simplices[1]:
+        if one_simplex in skeleton_path_simplices:
+            edge_class = 'skeleton'
+        elif one_simplex in controller.exception_one_simplices:
+            edge_class = 'exception'
+        elif one_simplex in fence_subcomplex.frontier_simplices:
+            edge_class = 'frontier'
+        elif one_simplex in fence_subcomplex.obstacle_simplices:
+            edge_class = 'obstacle'
+        else:
+            edge_class = 'normal'
+        edge_classes.append(_EDGE_CLASS_INDEX[edge_class])
+
+    return Snapshot(iteration,
+                    controller.robots.positions.copy(),
+                    controller.robot_is_obstacle.copy(),
+                    np.array(list(controller.simplices[1]), dtype=np.int32).reshape(-1, 2),
+                    np.array(edge_classes, dtype=np.uint8),
+                    np.array(skeleton_path, dtype=np.int32))
+
+
+class Recorder:
+    """
+    Appends a snapshot of the controller to a recording every iteration (see Controller.recorder). Snapshots are
+    buffered and written chunk_size at a time; close() writes the last, partial, chunk.
+    """
+
+    def __init__(self, path: str, sim_map: Map, chunk_size: int = 100, compress: bool = True) -> None:
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / 'map.json', 'w') as f:
+            json.dump({'boundary': sim_map.boundary, 'obstacles': sim_map.obstacles}, f)
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.iteration = len(RecordingReader(self.path))  # appending to an existing recording
+        self._buffer = []
+
+    def record(self, controller):
+        self._buffer.append(take_snapshot(controller, self.iteration))
+        self.iteration += 1
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        snapshots, self._buffer = self._buffer, []
+
+        def _pack(name, dtype, shape):
+            arrays = [getattr(s, name) for s in snapshots]
+            offsets = np.cumsum([0] + [len(a) for a in arrays])
+            return np.concatenate(arrays).astype(dtype).reshape(shape), offsets
+
+        # Positions are stored as float32, plenty for drawing and half the size
+        arrays = {'iterations': np.array([s.iteration for s in snapshots])}
+        for name, dtype, shape in [('robots', np.float32, (-1, 2)), ('robot_is_obstacle', bool, -1),
+                                   ('edges', np.int32, (-1, 2)), ('edge_classes', np.uint8, -1),
+                                   ('skeleton_path', np.int32, -1)]:
+            arrays[name], arrays[name + '_offsets'] = _pack(name, dtype, shape)
+        save = np.savez_compressed if self.compress else np.savez
+        save(self.path / f'chunk_{snapshots[0].iteration:08d}.npz', **arrays)
+
+    def close(self):
+        self.flush()
+
+
+class RecordingReader:
+    """Random access to the snapshots of a recording, loading one chunk at a time"""
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        self.chunks = sorted(self.path.glob('chunk_*.npz'))
+        self.starts = []
+        total = 0
+        for chunk in self.chunks:
+            with np.load(chunk) as data:
+                self.starts.append(total)
+                total += len(data['iterations'])
+        self._len = total
+        self._cached_chunk, self._cached_data = None, None
+
+    def __len__(self) -> int:
+        return self._len
+
+    def load_map(self) -> Map:
+        with open(self.path / 'map.json') as f:
+            sim_map = json.load(f)
+        return Map(sim_map['boundary'], sim_map['obstacles'])
+
+    def __getitem__(self, index: int) -> Snapshot:
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError(index)
+        chunk = int(np.searchsorted(self.starts, index, side='right')) - 1
+        if chunk != self._cached_chunk:
+            with np.load(self.chunks[chunk]) as data:
+                self._cached_chunk, self._cached_data = chunk, dict(data)
+        data, i = self._cached_data, index - self.starts[chunk]
+
+        def _unpack(name):
+            offsets = data[name + '_offsets']
+            return data[name][offsets[i]:offsets[i + 1]]
+
+        return Snapshot(int(data['iterations'][i]), _unpack('robots').astype(float), _unpack('robot_is_obstacle'),
+                        _unpack('edges'), _unpack('edge_classes'), _unpack('skeleton_path'))
+
+    def __iter__(self):
+        for index in range(self._len):
+            yield self[index]
@@ -0,0 +1,93 @@
+"""
+Live view drawn by a separate process, so the controller never waits for matplotlib.
+
+The renderer asks for a frame by setting an event once it has drawn the previous one and at most max_fps times per
+second. The controller only takes a Snapshot and puts it on the queue when the event is set, so frames the renderer
+couldn't draw are skipped before they are built and the view never lags behind. This module doesn't import
+matplotlib, only the renderer process does.
+"""
+import multiprocessing
+import os
+import queue
+import time
+
+from Recording import take_snapshot
+from Utils import Map
+
+
+def _render(sim_map: Map, labels: bool, snapshots: multiprocessing.Queue, ready: multiprocessing.Event,
+            max_fps: float):
+    from matplotlib import pyplot as plt
+    from Visualization import MapView
+
+    plt.ion()
+    view = MapView(sim_map, labels)
+    plt.show(block=False)
+    # On machines with few cores the simulation gets the CPU first: at nice 15 the renderer gets about 3% of a busy
+    # core and just draws less often
+    if hasattr(os, 'nice'):
+        os.nice(15)
+    ready.set()
+    while plt.fignum_exists(view.fig.number):
+        try:
+            snapshot = snapshots.get(timeout=0.05)
+        except queue.Empty:
+            view.canvas.flush_events()  # keep the window responsive
+            continue
+        if snapshot is None:  # end of the simulation
+            break
+        frame_start = time.monotonic()
+        view.draw(snapshot)
+        # Leave the CPU to the simulation until the next frame is due
+        remaining = frame_start + 1 / max_fps - time.monotonic()
+        if remaining > 0:
+            view.canvas.start_event_loop(remaining)
+        ready.set()
+
+    # Simulation ended, keep the last frame until the window is closed
+    if plt.fignum_exists(view.fig.number):
+        plt.ioff()
+        plt.show()
+
+
+class RemotePlot:
+    """
+    Drop-in for Visualization.Plot (see Controller.plot) drawing in its own process. With every=N only one out of N
+    calls to update_plot sends a snapshot, and only if the renderer is ready for it: the view is redrawn at most
+    max_fps times per second. The constructor waits for the window to be up, as Visualization.Plot does. close() lets
+    the renderer draw the last snapshot and keep its window open.
+    """
+
+    def __init__(self, controller, every: int = 1, labels: bool = True, max_fps: float = 10):
+        self.controller = controller
+        self.every = every
+        self._calls = 0
+        self.snapshots = multiprocessing.Queue(maxsize=2)
+        self.ready = multiprocessing.Event()
+        self.process = multiprocessing.Process(target=_render, daemon=False,
+                                               args=(controller.map, labels, self.snapshots, self.ready, max_fps))
+        self.process.start()
+        while not self.ready.wait(0.1) and self.process.is_alive():
+            pass  # importing matplotlib and drawing the map, unless the renderer failed to start
+        self.update_plot()
+
+    def update_plot(self):
+        self._calls += 1
+        if (self._calls - 1) % self.every == 0:
+            self.redraw()
+
+    def redraw(self):
+        # The renderer only sets ready once it took the previous snapshot, so the queue has room for this one
+        if self.ready.is_set() and self.process.is_alive():  # the window may have been closed
+            self.ready.clear()
+            self.snapshots.put_nowait(take_snapshot(self.controller))
+
+    def close(self, timeout: float = 5):
+        """Send the final state; the renderer process ends when its window is closed"""
+        if self.process.is_alive():
+            # Blocking puts, the final state must not be dropped
+            try:
+                self.snapshots.put(take_snapshot(self.controller), timeout=timeout)
+                self.snapshots.put(None, timeout=timeout)
+            except queue.Full:
+                pass
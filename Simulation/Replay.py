@@ -0,0 +1,87 @@
+"""
+Replay of a recording made with Recording.Recorder (e.g. python Batch.py --record run.rec), without running the
+simulation again.
+
+    python Replay.py run.rec                          # window with a slider to scrub through the iterations
+    python Replay.py run.rec --gif execution.gif      # GIF like the one in the README
+    python Replay.py run.rec --frames frames/         # one PNG per iteration
+"""
+import argparse
+from pathlib import Path
+
+import matplotlib
+
+from Recording import RecordingReader
+
+
+def _selected(reader: RecordingReader, start: int, stop: int, step: int) -> range:
+    return range(start, len(reader) if stop is None else min(stop, len(reader)), step)
+
+
+def export_gif(reader: RecordingReader, path: str, fps: int = 10, start: int = 0, stop: int = None, step: int = 1,
+               labels: bool = True, dpi: int = 100):
+    from matplotlib.animation import PillowWriter
+    from Visualization import MapView
+
+    view = MapView(reader.load_map(), labels, blit=False)
+    writer = PillowWriter(fps=fps)
+    with writer.saving(view.fig, path, dpi):
+        for index in _selected(reader, start, stop, step):
+            view.update(reader[index])
+            writer.grab_frame()
+
+
+def export_frames(reader: RecordingReader, directory: str, start: int = 0, stop: int = None, step: int = 1,
+                  labels: bool = True, dpi: int = 100):
+    from Visualization import MapView
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    view = MapView(reader.load_map(), labels, blit=False)
+    for index in _selected(reader, start, stop, step):
+        snapshot = reader[index]
+        view.update(snapshot)
+        view.fig.savefig(directory / f'iteration_{snapshot.iteration:06d}.png', dpi=dpi)
+
+
+def show(reader: RecordingReader, labels: bool = True):
+    from matplotlib import pyplot as plt
+    from matplotlib.widgets import Slider
+    from Visualization import MapView
+
+    view = MapView(reader.load_map(), labels)
+    view.fig.subplots_adjust(bottom=0.18)
+    slider = Slider(view.fig.add_axes([0.15, 0.04, 0.7, 0.03]), 'iteration', 0, len(reader) - 1,
+                    valinit=0, valstep=1)
+    slider.on_changed(lambda value: view.draw(reader[int(value)]))
+    view.draw(reader[0])
+    plt.show()
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Replay a recorded simulation.')
+    parser.add_argument('recording', help='recording directory')
+    parser.add_argument('--gif', help='write the iterations to this GIF instead of showing them')
+    parser.add_argument('--frames', help='write one PNG per iteration to this directory instead of showing them')
+    parser.add_argument('--fps', type=int, default=10)
+    parser.add_argument('--start', type=int, default=0, help='first iteration')
+    parser.add_argument('--stop', type=int, help='iteration to stop before')
+    parser.add_argument('--step', type=int, default=1, help='only every step-th iteration')
+    parser.add_argument('--no-labels', action='store_true', help="don't draw the robot ids")
+    args = parser.parse_args(argv)
+
+    reader = RecordingReader(args.recording)
+    if not len(reader):
+        parser.error(f'{args.recording} has no recorded iterations')
+    if args.gif or args.frames:
+        matplotlib.use('Agg')
+        if args.gif:
+            export_gif(reader, args.gif, args.fps, args.start, args.stop, args.step, not args.no_labels)
+        if args.frames:
+            export_frames(reader, args.frames, args.start, args.stop, args.step, not args.no_labels)
+    else:
+        show(reader, not args.no_labels)
+
+
+if __name__ == '__main__':
+    main()
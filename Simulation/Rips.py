@@ -1,17 +1,41 @@
+import argparse
+
 from Controller import Controller
-from Visualization import Plot
 
 
-def main(): 
-    controller = Controller('config.yaml', 'sim_001')
-    plot = Plot(controller)
+def main():
+    parser = argparse.ArgumentParser(description='Run a simulation and watch it.')
+    parser.add_argument('--config', default='config.yaml', help='config file, relative to this directory')
+    parser.add_argument('--sim', default='sim_001', help='simulation id in the config file')
+    parser.add_argument('--every', type=int, default=1, help='redraw the view every N iterations')
+    parser.add_argument('--no-labels', action='store_true', help="don't draw the robot ids")
+    parser.add_argument('--remote', action='store_true',
+                        help="draw in a separate process, the simulation doesn't wait for the view")
+    parser.add_argument('--checkpoint', help='file to save the state of the simulation to, to resume it later')
+    parser.add_argument('--checkpoint-every', type=int, default=100, help='iterations between checkpoints')
+    parser.add_argument('--resume', help='checkpoint to continue the simulation from, instead of starting it')
+    args = parser.parse_args()
+
+    controller = Controller.load_checkpoint(args.resume) if args.resume else Controller(args.config, args.sim)
+    if args.remote:
+        from RemotePlot import RemotePlot
+        plot = RemotePlot(controller, args.every, not args.no_labels)
+    else:
+        from Visualization import Plot
+        plot = Plot(controller, args.every, not args.no_labels)
     controller.plot = plot
-    i = 0
     while not controller.is_full_covered:
-        print('Iteration', i)
+        print('Iteration', controller.iterations)
         controller.run_iter()
-        i += 1
+        if args.checkpoint and controller.iterations % args.checkpoint_every == 0:
+            controller.save_checkpoint(args.checkpoint)
+    if args.checkpoint:
+        controller.save_checkpoint(args.checkpoint)
     print(f'{len(controller.robots)} robots were used to cover the map.')
+    if args.remote:
+        plot.close()
+    else:
+        plot.redraw()
     input('Press any key to end.')
 
 if __name__ == '__main__':
@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class RobotStore:
+    """
+    Robot positions as a growable (n_robots, 2) float64 array, with a bool array of the robots in contact with
+    obstacles. Appends double the capacity when it runs out, so they are amortized O(1).
+
+    positions and is_obstacle are views of the first len() rows, for vectorized code to use without copying; they are
+    only valid until the next append. Indexing a robot gives its position as an [x, y] list of floats, for the scalar
+    code: loops over many robots are better off with a single positions.tolist().
+    """
+
+    def __init__(self, capacity: int = 64) -> None:
+        self._positions = np.empty((capacity, 2), dtype=np.float64)
+        self._is_obstacle = np.zeros(capacity, dtype=bool)
+        self._n = 0
+
+    @property
+    def positions(self) -> np.ndarray:
+        return self._positions[:self._n]
+
+    @property
+    def is_obstacle(self) -> np.ndarray:
+        return self._is_obstacle[:self._n]
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, robot: int) -> list[float]:
+        if not -self._n <= robot < self._n:
+            raise IndexError(robot)
+        return self._positions[robot].tolist()
+
+    def __setitem__(self, robot: int, position: list[float]):
+        if not -self._n <= robot < self._n:
+            raise IndexError(robot)
+        self._positions[robot] = position
+
+    def __iter__(self):
+        return iter(self.positions.tolist())
+
+    def append(self, position: list[float], is_obstacle: bool = False):
+        if self._n == len(self._positions):
+            capacity = max(1, 2 * self._n)
+            old_positions, old_is_obstacle = self._positions, self._is_obstacle
+            self._positions = np.empty((capacity, 2), dtype=np.float64)
+            self._positions[:self._n] = old_positions[:self._n]
+            self._is_obstacle = np.zeros(capacity, dtype=bool)
+            self._is_obstacle[:self._n] = old_is_obstacle[:self._n]
+        self._positions[self._n] = position
+        self._is_obstacle[self._n] = is_obstacle
+        self._n += 1
+
+    def index(self, position: list[float]) -> int:
+        """First robot at position"""
+        matches = np.flatnonzero((self.positions == position).all(axis=1))
+        if not len(matches):
+            raise ValueError(f'No robot at {position}')
+        return int(matches[0])
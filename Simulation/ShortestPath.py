@@ -0,0 +1,120 @@
+import heapq
+import math
+
+from Utils import dial_dijkstra, get_csr_graph, get_path
+
+
+class IncrementalShortestPathTree:
+    """
+    Shortest path tree from the robot at the entrypoint, repaired between iterations instead of recomputed.
+
+    The repair is DynamicSWSF-FP (Ramalingam & Reps, the basis of LPA*): only robots whose incoming edges changed are
+    re-examined, and the work then spreads to the robots whose distance actually changes. Each robot's predecessor is
+    the in-neighbor with the smallest (distance, index) among those on one of its shortest paths, the same one
+    dial_dijkstra picks, so paths are the same as with a full recompute.
+    When most of the graph changed (or on the first iteration) the tree is rebuilt with dial_dijkstra instead.
+
+    The graph is a dict of dicts: graph[u][v] is the weight of u -> v. One-simplices go both ways, so the neighbors
+    of v in graph[v] are also its in-neighbors. It is kept by the tree and only changed through the edges passed to
+    update(), so an update costs as much as the edges that changed and the robots whose distance changes.
+    """
+
+    def __init__(self) -> None:
+        self.graph = {}
+        self.root = None
+        self.dist, self.rhs, self.previous = [], [], []
+
+    def update(self, edges: dict[tuple[int, int], int], root: int, n: int):
+        """
+        Repair the tree after the edges changed: edges maps (u, v) to the new weight of u -> v, None if the edge was
+        removed. Edges whose weight didn't change can be passed too. n is the number of robots.
+        """
+        changed = list(range(len(self.dist), n))
+        self.dist += [math.inf] * (n - len(self.dist))
+        self.rhs += [math.inf] * (n - len(self.rhs))
+        self.previous += [-1] * (n - len(self.previous))
+
+        # Robots whose incoming edges were added, removed or re-weighted
+        for (u, v), weight in edges.items():
+            out_edges = self.graph.get(u)
+            if (out_edges or {}).get(v) == weight:
+                continue
+            if weight is None:
+                del out_edges[v]
+                if not out_edges:
+                    del self.graph[u]
+            else:
+                self.graph.setdefault(u, {})[v] = weight
+            changed.append(v)
+        if root != self.root:
+            changed += [root] if self.root is None else [root, self.root]
+            self.root = root
+
+        if len(changed) > n // 2:
+            self._rebuild(n)
+            return
+
+        queue = []
+        for v in changed:
+            self._update_vertex(v, queue)
+
+        dist_changed = set()
+        while queue:
+            key, v = heapq.heappop(queue)
+            if key != self._key(v):
+                continue  # stale entry
+            dist_changed.add(v)
+            if self.dist[v] > self.rhs[v]:
+                self.dist[v] = self.rhs[v]
+            else:
+                self.dist[v] = math.inf
+                self._update_vertex(v, queue)
+            for s in self.graph.get(v, ()):
+                self._update_vertex(s, queue)
+
+        # A predecessor changes if the robot's distance, its in-edges or a neighbor's distance changed
+        stale_previous = set(changed) | dist_changed
+        for v in dist_changed:
+            stale_previous.update(self.graph.get(v, ()))
+        for v in stale_previous:
+            self.previous[v] = self._get_previous(v)
+
+    def path(self, v: int) -> list[int]:
+        """Robots from v back to the root, [] if v can't be reached."""
+        return get_path(self.previous, self.root, v)
+
+    def verify(self, graph: dict[int, dict[int, int]] = None):
+        """
+        Check distances and predecessors against a full dial_dijkstra run, and the graph against graph (e.g. from
+        get_graph) when given. Slow, meant for debugging.
+        """
+        if graph is not None:
+            assert {u: edges for u, edges in graph.items() if edges} == self.graph
+        dist, previous = dial_dijkstra(get_csr_graph(self.graph, len(self.dist)), self.root)
+        assert dist.tolist() == self.dist
+        assert previous.tolist() == self.previous
+
+    def _rebuild(self, n: int):
+        dist, previous = dial_dijkstra(get_csr_graph(self.graph, n), self.root)
+        self.dist, self.previous = dist.tolist(), previous.tolist()
+        self.rhs = list(self.dist)
+
+    def _update_vertex(self, v: int, queue: list):
+        if v != self.root:
+            self.rhs[v] = min((self.dist[u] + self.graph[u][v] for u in self.graph.get(v, ())), default=math.inf)
+        else:
+            self.rhs[v] = 0
+        if self.dist[v] != self.rhs[v]:
+            heapq.heappush(queue, (self._key(v), v))
+
+    def _key(self, v: int):
+        # Robots getting closer go first on ties: a robot taking over the spot of one that moved away is settled
+        # before the one that left, so the subtree of the latter isn't torn down and rebuilt
+        if self.dist[v] == self.rhs[v]:
+            return None
+        return min(self.dist[v], self.rhs[v]), self.dist[v] < self.rhs[v]
+
+    def _get_previous(self, v: int):
+        if v == self.root or self.dist[v] == math.inf:
+            return -1
+        return min((self.dist[u], u) for u in self.graph[v] if self.dist[u] + self.graph[u][v] == self.dist[v])[1]
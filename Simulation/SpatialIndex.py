@@ -0,0 +1,222 @@
+import math
+from collections import defaultdict
+
+import numpy as np
+
+# Slack added to query boxes so that points exactly at the query radius are never missed to rounding
+_EPSILON = 1e-9
+
+
+class SpatialGrid:
+    """
+    Uniform bucket grid over a list of points, answering "which points are within radius r" in O(local density).
+    The grid doesn't copy the points: callers update the list and then notify the grid with add() or move().
+    """
+
+    def __init__(self, points: list[list[float]], cell_size: float) -> None:
+        self.points = points
+        self.cell_size = cell_size
+        self.cells = defaultdict(set)
+        self.cell_of = {}
+
+    def _cell(self, x: float, y: float) -> tuple[int, int]:
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def add(self, index: int):
+        cell = self._cell(*self.points[index])
+        self.cells[cell].add(index)
+        self.cell_of[index] = cell
+
+    def move(self, index: int):
+        cell = self._cell(*self.points[index])
+        old_cell = self.cell_of[index]
+        if cell != old_cell:
+            self.cells[old_cell].remove(index)
+            if not self.cells[old_cell]:
+                del self.cells[old_cell]
+            self.cells[cell].add(index)
+            self.cell_of[index] = cell
+
+    def _candidates(self, point: list[float], radius: float):
+        x, y = point
+        cx1, cy1 = self._cell(x - radius - _EPSILON, y - radius - _EPSILON)
+        cx2, cy2 = self._cell(x + radius + _EPSILON, y + radius + _EPSILON)
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell:
+                    yield from cell
+
+    def neighbors(self, point: list[float], radius: float) -> dict[int, float]:
+        """
+        Points within radius of point (inclusive), mapped to their distance to it. Distances are computed like gudhi's
+        Euclidean distance (dx * dx, not dx ** 2, which can be one ulp off), so they are the filtration values of a
+        gudhi.RipsComplex bit for bit.
+        """
+        x1, y1 = point
+        neighbors = {}
+        for index in self._candidates(point, radius):
+            x2, y2 = self.points[index]
+            dx, dy = x1 - x2, y1 - y2
+            d = math.sqrt(dx * dx + dy * dy)
+            if d <= radius:
+                neighbors[index] = d
+        return neighbors
+
+    def any_within(self, point: list[float], radius: float) -> bool:
+        x1, y1 = point
+        for index in self._candidates(point, radius):
+            x2, y2 = self.points[index]
+            dx, dy = x1 - x2, y1 - y2
+            if math.sqrt(dx * dx + dy * dy) <= radius:
+                return True
+        return False
+
+
+class ObstacleGrid:
+    """
+    Static bucket grid over axis aligned rectangles, given as the rows x1, y1, x2, y2 of an array (see
+    Map.obstacle_array). Each rectangle is listed in every cell it overlaps, so a query only looks at the rectangles
+    in the cells the query box overlaps. Queries return rectangle indices in increasing order, the order a loop over
+    all the rectangles would find them in.
+
+    By default cells are about the size of a typical rectangle, so each rectangle is in a few cells and each cell
+    holds a few rectangles.
+    """
+
+    def __init__(self, rectangles: np.ndarray, cell_size: float = None) -> None:
+        self.rectangles = rectangles
+        self._boxes = rectangles.tolist()
+        if cell_size is None:
+            sides = np.maximum(rectangles[:, 2] - rectangles[:, 0], rectangles[:, 3] - rectangles[:, 1])
+            cell_size = float(np.median(sides)) if len(sides) else 0
+        self.cell_size = cell_size if cell_size > 0 else 1.0
+
+        self.cells = defaultdict(list)
+        for index, (x1, y1, x2, y2) in enumerate(self._boxes):
+            cx1, cy1 = self._cell(x1, y1)
+            cx2, cy2 = self._cell(x2, y2)
+            for cx in range(cx1, cx2 + 1):
+                for cy in range(cy1, cy2 + 1):
+                    self.cells[(cx, cy)].append(index)
+
+    def _cell(self, x: float, y: float) -> tuple[int, int]:
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def query_box(self, x1: float, y1: float, x2: float, y2: float) -> list[int]:
+        """Rectangles intersecting the box (borders included)"""
+        x1, y1, x2, y2 = x1 - _EPSILON, y1 - _EPSILON, x2 + _EPSILON, y2 + _EPSILON
+        cx1, cy1 = self._cell(x1, y1)
+        cx2, cy2 = self._cell(x2, y2)
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > len(self.cells):
+            # Box larger than the occupied part of the grid
+            cells = [cell for (cx, cy), cell in self.cells.items() if cx1 <= cx <= cx2 and cy1 <= cy <= cy2]
+        else:
+            cells = [self.cells[(cx, cy)] for cx in range(cx1, cx2 + 1) for cy in range(cy1, cy2 + 1)
+                     if (cx, cy) in self.cells]
+
+        candidates = cells[0] if len(cells) == 1 else sorted(set().union(*cells))
+        boxes = self._boxes
+        return [index for index in candidates if boxes[index][0] <= x2 and x1 <= boxes[index][2] and
+                boxes[index][1] <= y2 and y1 <= boxes[index][3]]
+
+    def query_segments(self, starts: np.ndarray, ends: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (segment, rectangle) pairs where the rectangle intersects the bounding box of the segment, as two index
+        arrays. Segments only cross rectangles among these.
+        """
+        lower, upper = np.minimum(starts, ends).tolist(), np.maximum(starts, ends).tolist()
+        segments, rectangles = [], []
+        for segment, ((x1, y1), (x2, y2)) in enumerate(zip(lower, upper)):
+            found = self.query_box(x1, y1, x2, y2)
+            segments += [segment] * len(found)
+            rectangles += found
+        return np.array(segments, dtype=np.intp), np.array(rectangles, dtype=np.intp)
+
+
+class ClearanceField:
+    """
+    Raster of the map: clearance[row, col] is a lower bound of the distance along the axes (max(|dx|, |dy|)) from any
+    point of the cell to the nearest obstacle or to the outside of the map, capped at max_clearance; free[row, col] is
+    whether no obstacle touches the cell and it is inside the map. Row is y, col is x, cell [0, 0] is at origin.
+
+    Both only answer "surely clear" questions exactly: cells next to the obstacles count as touched, so a point whose
+    cell is free or has a clearance above r is really that clear, while the others need the exact geometry.
+    """
+
+    def __init__(self, origin: tuple[float, float], resolution: float, clearance: np.ndarray, free: np.ndarray) -> None:
+        self.origin = origin
+        self.resolution = resolution
+        self.clearance = clearance
+        self.free = free
+
+    @staticmethod
+    def grid(boundary: list[list[float]], resolution: float = None) -> tuple[tuple[float, float], float, tuple[int, int]]:
+        """Origin, resolution and (rows, cols) shape of the raster of a map, with a ring of cells outside of it"""
+        (m_x1, m_y1), (m_x2, m_y2) = boundary
+        if resolution is None:
+            # 0.1 map units, but at most 4096 cells per side
+            resolution = max(0.1, max(m_x2 - m_x1, m_y2 - m_y1) / 4096)
+        shape = (math.ceil((m_y2 - m_y1) / resolution) + 3, math.ceil((m_x2 - m_x1) / resolution) + 3)
+        return (m_x1 - resolution, m_y1 - resolution), resolution, shape
+
+    @classmethod
+    def build(cls, boundary: list[list[float]], obstacles: np.ndarray, resolution: float = None,
+              max_clearance: float = 1.0) -> 'ClearanceField':
+        (o_x, o_y), resolution, (rows, cols) = cls.grid(boundary, resolution)
+        (m_x1, m_y1), (m_x2, m_y2) = boundary
+
+        def cell_range(v1, v2, origin, size):
+            return max(math.floor((v1 - origin) / resolution), 0), min(math.floor((v2 - origin) / resolution), size - 1)
+
+        # Touched cells: the ones any obstacle overlaps, and the ones reaching outside of the map
+        touched = np.ones((rows, cols), dtype=bool)
+        c1, c2 = cell_range(m_x1, m_x2, o_x, cols)
+        r1, r2 = cell_range(m_y1, m_y2, o_y, rows)
+        touched[r1 + 1:r2, c1 + 1:c2] = False
+        for x1, y1, x2, y2 in obstacles.tolist():
+            c1, c2 = cell_range(x1, x2, o_x, cols)
+            r1, r2 = cell_range(y1, y2, o_y, rows)
+            touched[r1:r2 + 1, c1:c2 + 1] = True
+
+        # Distance in cells to the nearest touched cell, growing the touched area one ring of cells at a time
+        max_cells = math.ceil(max_clearance / resolution) + 2
+        cells = np.full((rows, cols), max_cells, dtype=np.int32)
+        cells[touched] = 0
+        reached = touched
+        for distance in range(1, max_cells):
+            grown = reached.copy()
+            grown[1:, :] |= reached[:-1, :]
+            grown[:-1, :] |= reached[1:, :]
+            grown[:, 1:] |= grown[:, :-1].copy()
+            grown[:, :-1] |= grown[:, 1:].copy()
+            cells[grown & ~reached] = distance
+            reached = grown
+
+        # A point and the obstacle it is closest to are in cells distance apart, so at least distance - 1 cells away
+        # from each other; one cell more makes up for points rounded to the next cell
+        clearance = (np.maximum(cells - 2, 0) * resolution).astype(np.float32)
+        return cls((o_x, o_y), resolution, clearance, ~touched)
+
+    def _cell(self, x: float, y: float) -> tuple[int, int]:
+        return math.floor((y - self.origin[1]) / self.resolution), math.floor((x - self.origin[0]) / self.resolution)
+
+    def at(self, x: float, y: float) -> float:
+        """Clearance around the point, 0 outside of the raster"""
+        row, col = self._cell(x, y)
+        if 0 <= row < self.clearance.shape[0] and 0 <= col < self.clearance.shape[1]:
+            return float(self.clearance[row, col])
+        return 0.0
+
+    def is_free_box(self, x1: float, y1: float, x2: float, y2: float) -> bool:
+        """Whether surely no obstacle touches the box, and it is inside of the map"""
+        # O(1) when the clearance at the center of the box covers it
+        if self.at((x1 + x2) / 2, (y1 + y2) / 2) > max(x2 - x1, y2 - y1) / 2:
+            return True
+        row1, col1 = self._cell(x1, y1)
+        row2, col2 = self._cell(x2, y2)
+        # One more cell on each side for the points rounded to the next cell
+        row1, col1, row2, col2 = row1 - 1, col1 - 1, row2 + 1, col2 + 1
+        if row1 < 0 or col1 < 0 or row2 >= self.free.shape[0] or col2 >= self.free.shape[1]:
+            return False
+        return bool(self.free[row1:row2 + 1, col1:col2 + 1].all())
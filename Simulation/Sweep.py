@@ -0,0 +1,205 @@
+"""
+Parameter sweep: runs the controller headless for every combination of sigma, beta, robot_radius and seed on a set
+of scenarios, in parallel, and streams one row per run into a single results table.
+
+    python Sweep.py --sim sim_001 sim_002 --sigma 0.1 0.2 --beta 0.01 0.02 --robot-radius 1.2 1.414 --seeds 0 1 2 \
+        --output sweep.csv
+
+Scenarios are simulations of the config file (--sim) and/or generated maps from Benchmark.py (--maps, sized with
+--robots). Parameters that are not swept keep the value of the scenario.
+
+Runs go to a pool of worker processes. Workers import gudhi and NumPy once when they start, and the obstacles of each
+map are compiled once by this process into shared memory: a task only carries the parameters of its run, and every
+worker looks at the same copy of the obstacles (the clearance fields are shared the same way, memory-mapped from
+MapCache). Rows are written as runs finish, so the table can be read while the sweep is running; the output format
+(CSV or JSON lines) follows the file extension.
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import io
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+
+import Benchmark
+from Controller import Controller
+from MapCache import load_catalog, load_clearance_field
+from Utils import Map
+
+PHASES = ['simplices', 'fence_subcomplex', 'skeleton_path', 'push']
+COLUMNS = ['scenario', 'sigma', 'beta', 'robot_radius', 'seed', 'iterations', 'robots', 'coverage',
+           'frontier_simplices', 'wall_time'] + [f'{phase}_time' for phase in PHASES] + ['error']
+
+# Set in each worker by _init_worker: scenario -> (config without obstacles, Map over the shared obstacles)
+_scenarios = {}
+# Kept open for as long as the worker lives, the maps are views of them
+_shared_blocks = []
+
+
+def load_scenarios(config_path: str, sim_ids: list[str], maps: list[str], robots: int, seed: int = 0) -> dict:
+    """Configs of the scenarios, laid out like the entries of config.yaml"""
+    scenarios = {}
+    if sim_ids:
+        catalog = load_catalog(Path(__file__).parent / config_path)
+        scenarios.update((sim_id, catalog[sim_id]) for sim_id in sim_ids)
+    for map_name in maps:
+        scenarios[f'{map_name}_{robots}'] = Benchmark.MAPS[map_name](robots, seed)
+    return scenarios
+
+
+def get_tasks(scenarios: dict, sigmas: list[float] = None, betas: list[float] = None,
+              robot_radii: list[float] = None, seeds: list[int] = (0,)) -> list[dict]:
+    """One task per scenario and combination of the swept parameters, the others keep the value of the scenario"""
+    tasks = []
+    for name, config in scenarios.items():
+        for sigma, beta, robot_radius, seed in itertools.product(sigmas or [config['sigma']], betas or [config['beta']],
+                                                                  robot_radii or [config['robot_radius']], seeds):
+            tasks.append({'scenario': name, 'sigma': sigma, 'beta': beta, 'robot_radius': robot_radius, 'seed': seed})
+    return tasks
+
+
+def _share_obstacles(scenarios: dict, blocks: list) -> dict:
+    # Compile the obstacles of each scenario into a shared memory block, returns what workers need to attach to them
+    shared = {}
+    for name, config in scenarios.items():
+        sim_map = Map(config['map']['boundary'], config['map']['obstacles'])
+        # Build the clearance field once here, workers then load it memory-mapped from the cache
+        load_clearance_field(sim_map)
+
+        block = shared_memory.SharedMemory(create=True, size=max(sim_map.obstacle_array.nbytes, 1))
+        blocks.append(block)
+        np.ndarray(sim_map.obstacle_array.shape, float, block.buf)[:] = sim_map.obstacle_array
+        light_config = {**config, 'map': {**config['map'], 'obstacles': None}}
+        shared[name] = (light_config, block.name, sim_map.obstacle_array.shape)
+    return shared
+
+
+def _init_worker(shared: dict):
+    # gudhi and NumPy were imported with this module, the maps are built once per worker
+    for name, (config, block_name, shape) in shared.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _shared_blocks.append(block)
+        obstacle_array = np.ndarray(shape, float, block.buf)
+        obstacle_array.flags.writeable = False
+        sim_map = Map.from_obstacle_array(config['map']['boundary'], obstacle_array)
+        sim_map.clearance = load_clearance_field(sim_map)
+        _scenarios[name] = (config, sim_map)
+
+
+def run_task(task: dict, max_iterations: int) -> dict:
+    """Run one task in a worker, until the map is covered or max_iterations, and return its row of the table"""
+    config, sim_map = _scenarios[task['scenario']]
+    config = {**config, 'sigma': task['sigma'], 'beta': task['beta'], 'robot_radius': task['robot_radius']}
+    random.seed(task['seed'])
+    np.random.seed(task['seed'])
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        controller = Controller.from_config(config, sim_map)
+        while not controller.is_full_covered and controller.iterations < max_iterations:
+            controller.run_iter()
+    return {
+        **task,
+        'iterations': controller.iterations,
+        'robots': len(controller.robots),
+        'coverage': 'complete' if controller.is_full_covered else 'iteration_cap',
+        'frontier_simplices': len(controller.fence_subcomplex.frontier_simplices),
+        'wall_time': time.perf_counter() - start,
+        **{f'{phase}_time': controller.phase_times.get(phase, 0.0) for phase in PHASES},
+    }
+
+
+class _TableWriter:
+    # Rows to a CSV or JSON lines file (by extension) or to stdout as JSON lines, flushed one by one
+    def __init__(self, path: str = None) -> None:
+        self.file = open(path, 'w', newline='') if path else sys.stdout
+        self.csv = csv.DictWriter(self.file, COLUMNS, restval='') if path and path.endswith('.csv') else None
+        if self.csv:
+            self.csv.writeheader()
+
+    def write(self, row: dict):
+        if self.csv:
+            self.csv.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+def sweep(scenarios: dict, tasks: list[dict], max_iterations: int = 1000, workers: int = None, output: str = None,
+          on_row=None) -> int:
+    """
+    Run the tasks on a pool of worker processes and write their rows to output as they finish. A run that fails gets
+    a row with coverage 'error' and the exception, the sweep goes on. on_row(row, done, total) is called after each
+    row. Returns the number of failed runs.
+    """
+    blocks = []
+    writer = _TableWriter(output)
+    failed = 0
+    try:
+        shared = _share_obstacles(scenarios, blocks)
+        with concurrent.futures.ProcessPoolExecutor(workers or os.cpu_count(), initializer=_init_worker,
+                                                    initargs=(shared,)) as executor:
+            futures = {executor.submit(run_task, task, max_iterations): task for task in tasks}
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                try:
+                    row = future.result()
+                except Exception as e:
+                    row = {**futures[future], 'coverage': 'error', 'error': f'{type(e).__name__}: {e}'}
+                    failed += 1
+                writer.write(row)
+                if on_row is not None:
+                    on_row(row, done, len(futures))
+    finally:
+        writer.close()
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return failed
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Run the controller over a grid of parameters, in parallel.')
+    parser.add_argument('--config', default='config.yaml', help='config file, relative to this directory')
+    parser.add_argument('--sim', nargs='*', default=[], help='simulation ids in the config file')
+    parser.add_argument('--maps', nargs='*', default=[], choices=sorted(Benchmark.MAPS), help='generated maps')
+    parser.add_argument('--robots', type=int, default=1000, help='number of robots the generated maps are sized for')
+    parser.add_argument('--sigma', nargs='+', type=float, help='values of sigma, the one of the scenario if not given')
+    parser.add_argument('--beta', nargs='+', type=float, help='values of beta, the one of the scenario if not given')
+    parser.add_argument('--robot-radius', nargs='+', type=float,
+                        help='values of robot_radius, the one of the scenario if not given')
+    parser.add_argument('--seeds', nargs='+', type=int, default=[0])
+    parser.add_argument('--max-iterations', type=int, default=1000, help='per run')
+    parser.add_argument('--workers', type=int, help='worker processes, one per CPU if not given')
+    parser.add_argument('--output', help='.csv or .jsonl file to write the results table to, stdout if not given')
+    args = parser.parse_args(argv)
+
+    if not args.sim and not args.maps:
+        parser.error('no scenario, give --sim and/or --maps')
+    scenarios = load_scenarios(args.config, args.sim, args.maps, args.robots)
+    tasks = get_tasks(scenarios, args.sigma, args.beta, args.robot_radius, args.seeds)
+
+    def progress(row: dict, done: int, total: int):
+        if args.output:
+            print(f'{done}/{total} {row["scenario"]} sigma={row["sigma"]} beta={row["beta"]} '
+                  f'robot_radius={row["robot_radius"]} seed={row["seed"]}: {row["coverage"]}', file=sys.stderr)
+
+    failed = sweep(scenarios, tasks, args.max_iterations, args.workers, args.output, progress)
+    if failed:
+        sys.exit(f'{failed} of {len(tasks)} runs failed, see the error column')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,11 @@
-import heapq
 import math
 from collections import defaultdict
-from copy import deepcopy
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from math import pi
 
 import numpy as np
 
+from SpatialIndex import ClearanceField, ObstacleGrid, SpatialGrid
 
 @dataclass
 class Simplex:
@@ -15,26 +14,88 @@ class Simplex:
     two_simplices: list[int]
 
 
+# Simplices are tuples of sorted robot indices so that they can be stored in sets and dicts
+OneSimplex = tuple[int, int]
+TwoSimplex = tuple[int, int, int]
+
+
 @dataclass
 class FenceSubcomplex:
-    obstacle_simplices: list[list[int]]
-    frontier_simplices: list[list[int]]
+    obstacle_simplices: set[OneSimplex]
+    # dict used as an ordered set: keeps the order the frontier simplices were found in
+    frontier_simplices: dict[OneSimplex, None]
+
+
+@dataclass
+class CSRGraph:
+    # edges going out of robot u are indices[indptr[u]:indptr[u + 1]], with weights[indptr[u]:indptr[u + 1]]
+    indptr: np.ndarray
+    indices: np.ndarray
+    weights: np.ndarray
 
 
 @dataclass
 class Map:
     boundary: list[list[float]]
     obstacles: list[list[list[float]]]
+    # obstacles as a (n_obstacles, 4) array of x1, y1, x2, y2, for the vectorized geometry
+    obstacle_array: np.ndarray = field(init=False, repr=False)
+    # static spatial index of the obstacles, so that geometry checks only look at the obstacles around them
+    obstacle_index: ObstacleGrid = field(init=False, repr=False)
+    # Optional raster telling which areas are clear of obstacles (see MapCache.load_clearance_field), to skip the
+    # geometry checks there
+    clearance: ClearanceField = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        self.obstacle_array = np.array(self.obstacles, dtype=float).reshape(-1, 4)
+        self.obstacle_index = ObstacleGrid(self.obstacle_array)
+
+    @classmethod
+    def from_obstacle_array(cls, boundary: list[list[float]], obstacle_array: np.ndarray) -> 'Map':
+        """Map whose obstacle_array is the given array (e.g. in shared memory), used as is instead of copied"""
+        sim_map = cls.__new__(cls)
+        sim_map.boundary = boundary
+        sim_map.obstacles = obstacle_array.reshape(-1, 2, 2).tolist()
+        sim_map.obstacle_array = obstacle_array
+        sim_map.obstacle_index = ObstacleGrid(obstacle_array)
+        sim_map.clearance = None
+        return sim_map
+
+    def __getstate__(self):
+        # The clearance field is memory-mapped from the cache, it is loaded again instead of being copied
+        state = self.__dict__.copy()
+        state['clearance'] = None
+        return state
+
+
+def _query_obstacles(sim_map: Map, box: tuple[float, float, float, float]) -> list[int]:
+    # Obstacles intersecting the box, none when the clearance field shows it is clear
+    if sim_map.clearance is not None and sim_map.clearance.is_free_box(*box):
+        return []
+    return sim_map.obstacle_index.query_box(*box)
+
+
+def _obstacles_around(sim_map: Map, get_box):
+    """
+    Obstacles of sim_map intersecting the box (x1, y1, x2, y2) returned by get_box, in the order of sim_map.obstacles.
+    get_box is called again after each obstacle: when the box moved, the remaining obstacles are looked up around the
+    new box, so a loop that moves the box finds the same obstacles as a loop over all of them would.
+    """
+    box = get_box()
+    candidates = _query_obstacles(sim_map, box)
+    idx = 0
+    while idx < len(candidates):
+        obstacle = candidates[idx]
+        yield sim_map.obstacles[obstacle]
+        new_box = get_box()
+        if new_box != box:
+            box = new_box
+            candidates = [o for o in _query_obstacles(sim_map, box) if o > obstacle]
+            idx = 0
+        else:
+            idx += 1
 
 
-def get_pair_combinations(list_: list) -> list:
-    combinations = []
-    for i, e_1 in enumerate(list_):
-        for e_2 in list_[i + 1 :]:
-            combinations.append([e_1, e_2])
-    
-    return combinations
-
 def distance(pos1, pos2):
     (x1, y1) = pos1
     (x2, y2) = pos2
@@ -56,71 +117,99 @@ def get_angle(i, j, k):
         return theta_i_j_k - 2 * pi
 
 
-def get_graph(one_simplices: list[list[int]], fence_subcomplex: FenceSubcomplex, robot_is_obstacle) -> \
-        defaultdict[list[list[int]]]:
-    graph = defaultdict(list[list[int]])
+def get_edge_weights(one_simplex: OneSimplex, fence_subcomplex: FenceSubcomplex, robot_is_obstacle) -> \
+        tuple[int, int]:
+    # Weights of the edges i -> j and j -> i of get_graph
+    i, j = one_simplex
     obstacle_weight = 4
-    for one_simplex in one_simplices:
-        if one_simplex in fence_subcomplex.obstacle_simplices:
-            graph[one_simplex[1]].append([one_simplex[0], obstacle_weight])
-            graph[one_simplex[0]].append([one_simplex[1], obstacle_weight])
-        else:
-            # Note: Adding weight 'obstacle_weight' for robots in contact with obstacle as well
-            graph[one_simplex[1]].append([one_simplex[0], obstacle_weight if robot_is_obstacle[one_simplex[0]] else 1])
-            graph[one_simplex[0]].append([one_simplex[1], obstacle_weight if robot_is_obstacle[one_simplex[1]] else 1])
+    if one_simplex in fence_subcomplex.obstacle_simplices:
+        return obstacle_weight, obstacle_weight
+    # Note: Adding weight 'obstacle_weight' for robots in contact with obstacle as well
+    return obstacle_weight if robot_is_obstacle[j] else 1, obstacle_weight if robot_is_obstacle[i] else 1
+
+
+def get_graph(one_simplices: list[OneSimplex], fence_subcomplex: FenceSubcomplex, robot_is_obstacle) -> \
+        defaultdict[int, dict[int, int]]:
+    # graph[u][v] is the weight of the edge u -> v. Not used by the controller, which keeps its graph up to date in
+    # IncrementalShortestPathTree: this is the reference that IncrementalShortestPathTree.verify() checks it against
+    graph = defaultdict(dict)
+    for i, j in one_simplices:
+        graph[i][j], graph[j][i] = get_edge_weights((i, j), fence_subcomplex, robot_is_obstacle)
 
     return graph
 
 
-def lazy_dijkstra(graph, root, n):
-    # https://pythonalgos.com/dijkstras-algorithm-in-5-steps-with-python/
-    # set up "inf" distances
-    dist = [math.inf for _ in range(n)]
-    previous = {}
-    # set up root distance
+def get_csr_graph(graph: dict[int, dict[int, int]], n: int) -> CSRGraph:
+    counts = np.zeros(n + 1, dtype=np.int64)
+    indices, weights = [], []
+    for u in sorted(graph):
+        counts[u + 1] = len(graph[u])
+        indices.extend(graph[u].keys())
+        weights.extend(graph[u].values())
+    return CSRGraph(np.cumsum(counts), np.array(indices, dtype=np.int64), np.array(weights, dtype=np.int64))
+
+
+def dial_dijkstra(graph: CSRGraph, root: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Dijkstra with a bucket queue (Dial's algorithm) for the small integer weights of get_graph. All the robots at the
+    same distance are settled together, and their edges are relaxed in one vectorized step.
+    Returns dist (inf if unreachable) and previous (-1 for the root and unreachable robots). previous is the
+    neighbor with the smallest (dist, index) on a shortest path, the one a heap based Dijkstra settles first.
+    """
+    n = len(graph.indptr) - 1
+    dist = np.full(n, np.inf)
     dist[root] = 0
-    # set up visited node list
-    visited = [False for _ in range(n)]
-    # set up priority queue
-    pq = [(0.0, root)]
-    # while there are nodes to process
-    while len(pq) > 0:
-        # get the root, discard current distance
-        _, u = heapq.heappop(pq)
-        # if the node is visited, skip
-        if visited[u]:
+    buckets = defaultdict(list, {0: [np.array([root])]})
+    d = 0
+    while buckets:
+        if d not in buckets:
+            d += 1
             continue
-        # set the node to visited
-        visited[u] = True
-        # check the distance and node and distance
-        for v, l in graph[u]:
-            # if the current node's distance + distance to the node we're visiting
-            # is less than the distance of the node we're visiting on file
-            # replace that distance and push the node we're visiting into the priority queue
-            if dist[u] + l < dist[v]:
-                dist[v] = dist[u] + l
-                previous[v] = u
-                heapq.heappush(pq, (dist[v], v))
-
-    paths = [[] for _ in range(n)]
-    if previous == {}:
-        paths[root].append(root)
-    else:
-        for dest, path in enumerate(paths):
-            current = dest
-            while current != root:
-                path.append(current)
-                current = previous[current]
-            path.append(root)
-
-    return dist, paths
+        frontier = np.unique(np.concatenate(buckets.pop(d)))
+        frontier = frontier[dist[frontier] == d]  # skip robots that were reached with a shorter distance
+
+        # every edge going out of the frontier
+        starts, counts = graph.indptr[frontier], np.diff(graph.indptr)[frontier]
+        edges = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        v, new_dist = graph.indices[edges], d + graph.weights[edges]
+        improved = new_dist < dist[v]
+        v, new_dist = v[improved], new_dist[improved]
+        np.minimum.at(dist, v, new_dist)
+        for w in np.unique(new_dist):
+            buckets[int(w)].append(v[new_dist == w])
+        d += 1
+
+    # Predecessor: smallest (dist, index) among the neighbors on a shortest path
+    u = np.repeat(np.arange(n), np.diff(graph.indptr))
+    v = graph.indices
+    tight = dist[u] + graph.weights == dist[v]
+    u, v = u[tight], v[tight]
+    order = np.lexsort((u, dist[u], v))
+    u, v = u[order], v[order]
+    first = np.ones(len(v), dtype=bool)
+    first[1:] = v[1:] != v[:-1]
+    previous = np.full(n, -1, dtype=np.int64)
+    previous[v[first]] = u[first]
+    previous[root] = -1
+    return dist, previous
+
+
+def get_path(previous, root: int, target: int) -> list[int]:
+    """Robots from target back to root following the predecessors, [] if target can't be reached."""
+    path = [target]
+    while target != root:
+        target = previous[target]
+        if target < 0:
+            return []
+        path.append(target)
+    return path
 
 
 # ------------------------- get_fence_subcomplex functions  ---------------------------#
 
 def ensure_valid_deploy_position(
         sim_map: Map, 
-        robots: list[list],
+        robot_index: SpatialGrid,
         current_position: list[float], 
         deploy_positions: list[list], 
         sigma: float,
@@ -170,7 +259,10 @@ def ensure_valid_deploy_position(
         a_den = dx - cx
         a = 0 if a_den == 0 else (dy - cy) / a_den
         b = cy - a * cx
-        for (o_x1, o_y1), (o_x2, o_y2) in sim_map.obstacles:
+        def near_deploy_position():
+            return dx - obstacle_radius, dy - obstacle_radius, dx + obstacle_radius, dy + obstacle_radius
+
+        for (o_x1, o_y1), (o_x2, o_y2) in _obstacles_around(sim_map, near_deploy_position):
             if o_x1 <= dx <= o_x2:
                 if o_y1 <= dy <= o_y2:
                     if cx <= o_x1:
@@ -192,7 +284,10 @@ def ensure_valid_deploy_position(
                 is_obstacle = True  # robot near obstacle
 
         # check if deploy is after a obstacle
-        for (o_x1, o_y1), (o_x2, o_y2) in sim_map.obstacles:
+        def around_path():
+            return min(cx, dx), min(cy, dy), max(cx, dx), max(cy, dy)
+
+        for (o_x1, o_y1), (o_x2, o_y2) in _obstacles_around(sim_map, around_path):
             if (
                 ( 
                     (cx < o_x1 and dx > o_x2) or
@@ -221,15 +316,12 @@ def ensure_valid_deploy_position(
                     dy = o_y1 - margin
         
         # check if new deploy position is obstructed
-        [dx, dy], is_obstacle_from_obstruction = check_obstruction_between_robots([cx, cy], [dx, dy], sim_map.obstacles, margin)
+        path_obstacles = _query_obstacles(sim_map, around_path())
+        [dx, dy], is_obstacle_from_obstruction = check_obstruction_between_robots([cx, cy], [dx, dy], sim_map.obstacle_array[path_obstacles], margin)
         is_obstacle = is_obstacle or is_obstacle_from_obstruction
         
-        continue_outer_loop = False
-        for r in robots:
-            if distance(r, [dx, dy]) <= sigma:
-                continue_outer_loop = True
-                break
-        if continue_outer_loop:
+        # deploy position is too close to another robot
+        if robot_index.any_within([dx, dy], sigma):
             continue
 
         return [dx, dy], is_obstacle
@@ -252,50 +344,70 @@ def is_obstacle_simplex(one_simplex: list[int], robot_is_obstacle: defaultdict[b
     return False
 
 
-def get_deployment_absolute_position(robot_a_coordinate: list, robot_b_coordinate: list,
-                                     deployment_angle: float, r: float) -> list:
-    
-    a, b = robot_a_coordinate
-    c, d = robot_b_coordinate
-    rot = np.array(( (np.cos(deployment_angle), -np.sin(deployment_angle)),
-                     (np.sin(deployment_angle),  np.cos(deployment_angle)) ))
-    
-    ab_vec = np.array([c-a, d-b])
-    ab_vec_norm = (ab_vec / np.linalg.norm(ab_vec))
-    rotated_scaled_vector = rot.dot(ab_vec_norm) * r
-    x = rotated_scaled_vector[0] + a
-    y = rotated_scaled_vector[1] + b
-    return [x, y]
-
-
-def get_deployment_angle(obstacle_simplices, robots: list, one_simplex: list,
-                         one_simplices: list, uncov: list, beta: float) -> tuple[list[float], list[float]]:
+def get_angles(positions: np.ndarray, triples) -> np.ndarray:
+    """Vectorized get_angle: angle at robot i from robot j to robot k for each (i, j, k) row of triples"""
+    triples = np.asarray(triples, dtype=np.intp).reshape(-1, 3)
+    i, j, k = positions[triples[:, 0]], positions[triples[:, 1]], positions[triples[:, 2]]
+    # math.atan2 rather than np.arctan2, whose SIMD loops differ in the last bit: the angles end up in the deployment
+    # positions, and a last bit change there breaks ties between 1-simplices of the same length in the filtration
+    j_i, k_i = (j - i).T.tolist(), (k - i).T.tolist()
+    theta_i_j = np.fromiter(map(math.atan2, j_i[1], j_i[0]), dtype=float, count=len(triples))
+    theta_i_k = np.fromiter(map(math.atan2, k_i[1], k_i[0]), dtype=float, count=len(triples))
+    theta_i_j_k = theta_i_k - theta_i_j
+    return np.where(theta_i_j_k < -pi, theta_i_j_k + 2 * pi,
+                    np.where(theta_i_j_k < pi, theta_i_j_k, theta_i_j_k - 2 * pi))
+
+
+def get_deployment_absolute_positions(positions: np.ndarray, pairs, deployment_angles, r: float) -> np.ndarray:
+    """
+    Deployment position of each (a, b) row of pairs of robots: the unit vector from a to b, rotated by its deployment
+    angle and scaled by r, from a. Returns a (len(pairs), 2) array.
+    """
+    pairs = np.asarray(pairs, dtype=np.intp).reshape(-1, 2)
+    deployment_angles = np.asarray(deployment_angles, dtype=float)
+    a, b = positions[pairs[:, 0]], positions[pairs[:, 1]]
+    ab = b - a
+    # Stacked matmuls round like the np.dot of the 2x2 rotation matrices, see get_angles on why the last bit matters
+    ab = ab / np.sqrt(ab[:, None, :] @ ab[:, :, None])[:, 0]
+    cos, sin = np.cos(deployment_angles), np.sin(deployment_angles)
+    rot = np.stack((np.stack((cos, -sin), axis=1), np.stack((sin, cos), axis=1)), axis=1)
+    return (rot @ ab[:, :, None])[:, :, 0] * r + a
+
+
+def _sign(x: float) -> int:
+    return (x > 0) - (x < 0)
+
+
+def get_deployment_angle(obstacle_simplices, one_simplex: list, adjacency: defaultdict[int, dict], uncov: list,
+                         beta: float, candidate_angles: tuple[list, list]) -> tuple[list[float], list[float]]:
+    """
+    candidate_angles are the (l, theta_i_j_l) of the neighbors l of i and the (l, theta_j_i_l) of the neighbors l of
+    j, as computed by get_fence_candidate_angles
+    """
     theta_i_j_new, theta_j_i_new = [], []
     i, j = one_simplex
     for sigma in uncov:
-        S_i, S_j = get_closest_fence_candidates(robots, one_simplex, one_simplices, sigma)
+        S_i, S_j = get_closest_fence_candidates(candidate_angles, sigma)
         if not S_i:
             theta_i_j_new.append(sigma * pi / 3)
         else:
-            k_i = min([[k, abs(get_angle(robots[i], robots[j], robots[k]))] for k in S_i], key=lambda x: x[1])[0]
-            theta_i_j_k_i = get_angle(robots[i], robots[j], robots[k_i])
+            k_i, theta_i_j_k_i = min(S_i, key=lambda x: abs(x[1]))
             if abs(theta_i_j_k_i) < pi / 3 - 2 * beta:
-                if sorted([j,k_i]) not in one_simplices:
-                    obstacle_simplices.append(sorted([i, k_i]))
-                    obstacle_simplices.append([i,j])
+                if k_i not in adjacency[j]:
+                    obstacle_simplices.add((i, k_i) if i < k_i else (k_i, i))
+                    obstacle_simplices.add((i, j))
             else:
                 theta_i_j_new.append(sigma * min([pi / 3, abs(theta_i_j_k_i / 2)]))
 
         if not S_j:
             theta_j_i_new.append(-sigma * pi / 3)
         else:
-            k_j = min([[k, abs(get_angle(robots[j], robots[i], robots[k]))] for k in S_j], key=lambda x: x[1])[0]
-            theta_j_i_k_j = get_angle(robots[j], robots[i], robots[k_j])
+            k_j, theta_j_i_k_j = min(S_j, key=lambda x: abs(x[1]))
 
             if abs(theta_j_i_k_j) < pi / 3 - 2 * beta :
-                if sorted([i,k_j]) not in one_simplices:
-                    obstacle_simplices.append(sorted([j, k_j])) 
-                    obstacle_simplices.append([i,j])
+                if k_j not in adjacency[i]:
+                    obstacle_simplices.add((j, k_j) if j < k_j else (k_j, j))
+                    obstacle_simplices.add((i, j))
 
             else:
                 theta_j_i_new.append(-sigma * min([pi / 3, abs(theta_j_i_k_j / 2)]))
@@ -303,115 +415,218 @@ def get_deployment_angle(obstacle_simplices, robots: list, one_simplex: list,
     return theta_i_j_new, theta_j_i_new
 
 
-def get_closest_fence_candidates(robots: list, one_simplex: list, one_simplices: list[list], sigma: int):
-    S_i, S_j = [], []
-    i, j = one_simplex
-    for l1, l2 in one_simplices:
-        if [l1, l2] == [i, j]:
-            continue
-
-        if i in [l1, l2]:
-            l_i = l1 if i == l2 else l2
-            if np.sign(get_angle(robots[i], robots[j], robots[l_i])) == sigma:
-                S_i.append(l_i)
-
-        if j in [l1, l2]:
-            l_j = l2 if l1 == j else l1
-            if np.sign(get_angle(robots[j], robots[i], robots[l_j])) == -sigma:
-                S_j.append(l_j)
-
+def get_closest_fence_candidates(candidate_angles: tuple[list, list], sigma: int):
+    angles_i, angles_j = candidate_angles
+    S_i = [(l_i, theta) for l_i, theta in angles_i if _sign(theta) == sigma]
+    S_j = [(l_j, theta) for l_j, theta in angles_j if _sign(theta) == -sigma]
     return S_i, S_j
 
 
-def get_one_simplex_uncov(robots, one_simplex: list, two_simplices: list[list]) -> list:
-    previous_angle, current_angle = None, None
-    i, j = one_simplex
-    for two_simplex in two_simplices:
-        diff = [x for x in two_simplex if x not in one_simplex]
-        if len(diff) == 1:  # Checks 2 simplices that {i, j, k_u} that have one simplex {i, j} as their vertices
-            k_u = diff[0]
-            current_angle = get_angle(robots[i], robots[j], robots[k_u])
-            if previous_angle is None:
-                previous_angle = current_angle
-                continue
-            if np.sign(previous_angle) != np.sign(current_angle):
-                return []
-
-    if current_angle is None:
+def get_fence_candidate_angles(positions: np.ndarray, one_simplices: list[OneSimplex],
+                               adjacency: defaultdict[int, dict]) -> list[tuple[list, list]]:
+    """
+    For each 1-simplex {i, j}: the (l, theta_i_j_l) of the neighbors l != j of i and the (l, theta_j_i_l) of the
+    neighbors l != i of j, in adjacency order. The angles of all the 1-simplices are computed in one pass.
+    """
+    triples, neighbors = [], []
+    for i, j in one_simplices:
+        neighbors_i = [l for l in adjacency[i] if l != j]
+        neighbors_j = [l for l in adjacency[j] if l != i]
+        triples.extend((i, j, l) for l in neighbors_i)
+        triples.extend((j, i, l) for l in neighbors_j)
+        neighbors.append((neighbors_i, neighbors_j))
+    angles = get_angles(positions, triples).tolist()
+
+    candidate_angles, start = [], 0
+    for neighbors_i, neighbors_j in neighbors:
+        middle, end = start + len(neighbors_i), start + len(neighbors_i) + len(neighbors_j)
+        candidate_angles.append((list(zip(neighbors_i, angles[start:middle])),
+                                 list(zip(neighbors_j, angles[middle:end]))))
+        start = end
+    return candidate_angles
+
+
+def _get_uncov(angles: list[float]) -> list:
+    # Angles of the 2-simplices {i, j, k_u} that have one simplex {i, j} as their vertices
+    if not angles:
         return [-1, 1]
+    first_sign = _sign(angles[0])
+    if any(_sign(angle) != first_sign for angle in angles):
+        return []
 
-    if np.sign(current_angle) == 0:
+    if first_sign == 0:
         return [-1, 1]
-    elif np.sign(current_angle) > 0:
+    elif first_sign > 0:
         return [-1]
     else:
         return [1]
 
 
+def get_one_simplices_uncov(positions: np.ndarray, one_simplices: list[OneSimplex],
+                            cofaces: defaultdict[tuple, list[int]]) -> list[list]:
+    """
+    Uncovered sides of each of one_simplices (see _get_uncov), with the angles to all their cofaces computed in one
+    pass
+    """
+    triples, counts = [], []
+    for i, j in one_simplices:
+        k_us = cofaces.get((i, j), [])
+        triples.extend((i, j, k_u) for k_u in k_us)
+        counts.append(len(k_us))
+    angles = get_angles(positions, triples).tolist()
+
+    uncovs, start = [], 0
+    for count in counts:
+        uncovs.append(_get_uncov(angles[start:start + count]))
+        start += count
+    return uncovs
+
+
 def point_inside_line(px, py, ax, ay, bx, by):
     return (ax <= px <= bx or bx <= px <= ax) and (by <= py <= ay or ay <= py <= by)
 
 
-def find_robot_neighbors(robot:int, one_simplices: list[list[int]]):
-    k_neighbors = []
-    for _one_simplex in one_simplices:
-        diff = [x for x in _one_simplex if x != robot]
-        if len(diff) == 1:
-            k_neighbors.append(diff[0])
-    return k_neighbors
+def _points_inside_lines(px, py, ax, ay, bx, by):
+    # Vectorized point_inside_line
+    return (np.minimum(ax, bx) <= px) & (px <= np.maximum(ax, bx)) & \
+           (np.minimum(ay, by) <= py) & (py <= np.maximum(ay, by))
+
+
+def segments_cross_obstacles(x1, y1, x2, y2, obs_x1, obs_y1, obs_x2, obs_y2) -> np.ndarray:
+    """
+    Vectorized version of the segment x obstacle test done by check_obstruction_between_robots: the line through
+    the segment is intersected with each side of the obstacle rectangle. All arguments are broadcast together,
+    returns a boolean array telling which segment x obstacle pairs cross.
+    """
+    x1, y1, x2, y2 = (np.asarray(v, dtype=float) for v in (x1, y1, x2, y2))
+    a_den = x2 - x1
+    vertical = a_den == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Finding line equation : y = ax + b
+        a = (y2 - y1) / a_den
+        b = y1 - a * x1
+
+        # two robots are vertically aligned
+        crosses_vertical = (obs_x1 <= x1) & (x1 <= obs_x2) & _points_inside_lines(x1, obs_y1, x1, y1, x2, y2)
+
+        y_1 = a * obs_x1 + b
+        y_2 = a * obs_x2 + b
+        crosses = ((obs_y1 <= y_1) & (y_1 <= obs_y2) & _points_inside_lines(obs_x1, y_1, x1, y1, x2, y2)) | \
+                  ((obs_y1 <= y_2) & (y_2 <= obs_y2) & _points_inside_lines(obs_x2, y_2, x1, y1, x2, y2))
+
+        # two robots horizontally aligned
+        horizontal = a == 0
+        crosses_horizontal = (obs_y1 <= y1) & (y1 <= obs_y2) & _points_inside_lines(obs_x1, y1, x1, y1, x2, y2)
+
+        x_1 = (obs_y1 - b) / a
+        x_2 = (obs_y2 - b) / a
+        crosses_oblique = ((obs_x1 <= x_1) & (x_1 <= obs_x2) & _points_inside_lines(x_1, obs_y1, x1, y1, x2, y2)) | \
+                          ((obs_x1 <= x_2) & (x_2 <= obs_x2) & _points_inside_lines(x_2, obs_y2, x1, y1, x2, y2))
+
+    return np.where(vertical, crosses_vertical,
+                    crosses | np.where(horizontal, crosses_horizontal, crosses_oblique))
+
+
+def get_obstructed_one_simplices(starts: np.ndarray, ends: np.ndarray, obstacle_index: ObstacleGrid) -> np.ndarray:
+    """
+    Check every one-simplex against the obstacles around it at once (robots cannot see each other through obstacles).
+    starts, ends: (n_simplices, 2) robot positions, obstacle_index: Map.obstacle_index.
+    Returns a boolean mask of the obstructed one-simplices.
+    """
+    obstructed = np.zeros(len(starts), dtype=bool)
+    if len(starts) == 0:
+        return obstructed
+
+    # Only the obstacles overlapping the bounding box of a one-simplex can cross it
+    segments, obstacles = obstacle_index.query_segments(starts, ends)
+    x1, y1 = starts[segments, 0], starts[segments, 1]
+    x2, y2 = ends[segments, 0], ends[segments, 1]
+    obs_x1, obs_y1, obs_x2, obs_y2 = obstacle_index.rectangles[obstacles].T
+    obstructed[segments[segments_cross_obstacles(x1, y1, x2, y2, obs_x1, obs_y1, obs_x2, obs_y2)]] = True
+    return obstructed
 
-def remove_one_simplex(one_simplex, two_simplices):
-    two_simplices_without_exception = []
-    for two_simplex in two_simplices:
-        diff = [x for x in one_simplex if x in two_simplex]
-        if len(diff) != 2:
-            two_simplices_without_exception.append(two_simplex)
-    return two_simplices_without_exception
 
-def filter_exceptions(robots: list, simplices: dict) -> tuple[list, list]:
+def find_robot_neighbors(robot:int, adjacency: defaultdict[int, dict]):
+    return list(adjacency.get(robot, ()))
+
+
+def get_cofaces(two_simplices: list[list[int]]) -> defaultdict[tuple, list[int]]:
+    """
+    Coface index: maps each one simplex (i, j) to the third vertex k of every two simplex {i, j, k} containing it,
+    in the order the two simplices are listed.
+    """
+    cofaces = defaultdict(list)
+    for i, j, k in two_simplices:
+        cofaces[(i, j)].append(k)
+        cofaces[(i, k)].append(j)
+        cofaces[(j, k)].append(i)
+    return cofaces
+
+
+def remove_one_simplex(one_simplex, cofaces: defaultdict[tuple, list[int]]):
+    # Removes the two simplices that contain one_simplex from the coface index
+    i, j = one_simplex
+    for k in cofaces.pop((i, j), []):
+        cofaces[(i, k) if i < k else (k, i)].remove(j)
+        cofaces[(j, k) if j < k else (k, j)].remove(i)
+
+def get_exception_one_simplex(robots: list, one_simplex: OneSimplex, k: int, k_neighbors: list[int]) -> OneSimplex:
+    """
+    Exception test of filter_exceptions for one_simplex {i, j}, with k the third vertex of its first 2-simplex and
+    k_neighbors the neighbors of k other than i and j. Returns the 1-simplex to remove, None if there is no crossing.
+    """
+    i, j = one_simplex
+    theta_k_ij = get_angle(robots[k], robots[i], robots[j])
+    theta_k_ij_sign = np.sign(theta_k_ij)
+    possible_exceptions = []
+    for neighbor in k_neighbors:
+        # If there is a crossing happening between {i,j} and {k,k_neighbor} than the sum of angles will be of the same sign
+        # which means they are not supposed to be in the fence subcomplex.
+        if (
+                theta_k_ij_sign == np.sign(get_angle(robots[k], robots[i], robots[neighbor])) and
+                theta_k_ij_sign == np.sign(get_angle(robots[k], robots[neighbor], robots[j])) and
+                # This check is to see if the two simplex being analized is inside smaller two simplicex. If it is the neighbor and k will be on the same side of the edge, meaning that they dont cross the edge. 
+                np.sign(get_angle(robots[i], robots[j], robots[k])) != np.sign(get_angle(robots[i], robots[j], robots[neighbor]))
+        ):
+            # TODO: Optional improvement, compare the one_simplex to the neighbor simplex it is overlapping. Add to the exeption the biggest edge(the one_simplex were the robots are farthest away)
+            possible_exceptions.append((k, neighbor) if k < neighbor else (neighbor, k))
+
+    if possible_exceptions == []:
+        return None
+    possible_exceptions.append(one_simplex)
+    return max(possible_exceptions, key=lambda x: distance(robots[x[0]], robots[x[1]]))
+
+
+def filter_exceptions(robots: list, simplices: dict, adjacency: defaultdict[int, dict]) -> \
+        tuple[set[OneSimplex], defaultdict, defaultdict]:
     # We have to remove the false positive fences (when uncov !=0, but it is not fence)
     # This filter could also be applied after finding out the fence subcomplex
-    normal = {1: deepcopy(simplices[1]), 2: deepcopy(simplices[2])}
-    exception = []
-    for one_simplex in deepcopy(simplices[1]):
+    normal = {1: defaultdict(dict, {i: dict(neighbors) for i, neighbors in adjacency.items()}),
+              2: get_cofaces(simplices[2])}
+    exception = set()
+    for one_simplex in simplices[1]:
         if one_simplex in exception:
             continue
 
-        for two_simplex in normal[2]:
-            diff = [x for x in two_simplex if x not in one_simplex]
-            if len(diff) == 1:
-                break
-        else:
+        i, j = one_simplex
+        two_simplices_k = normal[2].get((i, j))
+        if not two_simplices_k:
             continue
 
-        i, j = one_simplex
         # Taking first neighbor to help find if there is an exception. Maybe should analyze more neighbors if no exception is found
-        k = diff[0]
+        k = two_simplices_k[0]
         k_neighbors = [x for x in find_robot_neighbors(k, normal[1]) if x!= i and x!=j]
 
-        theta_k_ij = get_angle(robots[k], robots[i], robots[j])
-        theta_k_ij_sign = np.sign(theta_k_ij)
-        possible_exceptions = []
-        for neighbor in k_neighbors:
-            # If there is a crossing happening between {i,j} and {k,k_neighbor} than the sum of angles will be of the same sign
-            # which means they are not supposed to be in the fence subcomplex.
-            if (
-                    theta_k_ij_sign == np.sign(get_angle(robots[k], robots[i], robots[neighbor])) and
-                    theta_k_ij_sign == np.sign(get_angle(robots[k], robots[neighbor], robots[j])) and
-                    # This check is to see if the two simplex being analized is inside smaller two simplicex. If it is the neighbor and k will be on the same side of the edge, meaning that they dont cross the edge. 
-                    np.sign(get_angle(robots[i], robots[j], robots[k])) != np.sign(get_angle(robots[i], robots[j], robots[neighbor]))
-            ):
-                # TODO: Optional improvement, compare the one_simplex to the neighbor simplex it is overlapping. Add to the exeption the biggest edge(the one_simplex were the robots are farthest away)
-                possible_exceptions.append(sorted([k, neighbor]))
-        
-        if possible_exceptions != []:
-            possible_exceptions.append(one_simplex)
-            higher_distance_exception = max(possible_exceptions, key=lambda x: distance(robots[x[0]], robots[x[1]]))
-            if higher_distance_exception in normal[1]:
-                normal[1].remove(higher_distance_exception)
-            exception.append(higher_distance_exception)
-            normal[2] = remove_one_simplex(higher_distance_exception, normal[2])
+        higher_distance_exception = get_exception_one_simplex(robots, one_simplex, k, k_neighbors)
+        if higher_distance_exception is not None:
+            e_i, e_j = higher_distance_exception
+            if e_j in normal[1][e_i]:
+                del normal[1][e_i][e_j]
+                del normal[1][e_j][e_i]
+            exception.add(higher_distance_exception)
+            remove_one_simplex(higher_distance_exception, normal[2])
 
+    # normal simplices are returned as the adjacency and coface indexes
     return exception, normal[1], normal[2]
 
 
@@ -426,11 +641,15 @@ def check_obstruction_between_robots(current_robot, deploy_robot, obstacles, mar
         a = (d_y - c_y) / a_den
         b = c_y - a * c_x
 
-    for (obs_x1, obs_y1), (obs_x2, obs_y2) in obstacles:
+    # Only the obstacles the segment crosses can obstruct it, the first one decides
+    obs_x1, obs_y1, obs_x2, obs_y2 = obstacles.T
+    crossed = np.flatnonzero(segments_cross_obstacles(c_x, c_y, d_x, d_y, obs_x1, obs_y1, obs_x2, obs_y2))
+    for obs_x1, obs_y1, obs_x2, obs_y2 in obstacles[crossed[:1]].tolist():
         if a_den == 0:
             # two robots are vertically aligned
             if obs_x1 <= c_x <= obs_x2 and point_inside_line(c_x, obs_y1, c_x, c_y, d_x, d_y):
-                return True
+                d_y = obs_y1 - margin if d_y > c_y else obs_y2 + margin
+                return [d_x, d_y], True
         else:
             y1 = a * obs_x1 + b
             if obs_y1 <= y1 <= obs_y2 and point_inside_line(obs_x1, y1, c_x, c_y, d_x, d_y):
@@ -464,7 +683,8 @@ def check_obstruction_between_robots(current_robot, deploy_robot, obstacles, mar
                     if a == 0:
                         # two robots horizontally aligned
                         if obs_y1 <= c_y <= obs_y2 and point_inside_line(obs_x1, c_y, c_x, c_y, d_x, d_y):
-                            return True
+                            d_x = obs_x1 - margin if d_x > c_x else obs_x2 + margin
+                            return [d_x, d_y], True
                     else:
                         x1 = (obs_y1 - b) / a
                         if obs_x1 <= x1 <= obs_x2 and point_inside_line(x1, obs_y1, c_x, c_y, d_x, d_y):
@@ -1,17 +1,39 @@
 import matplotlib
 import numpy as np
 from matplotlib import pyplot as plt
+from matplotlib.collections import LineCollection
 from matplotlib.patches import Rectangle
 
+from Recording import EDGE_CLASSES, Snapshot, take_snapshot
+from Utils import Map
 
-class Plot:
-    def __init__(self, controller):
-        plt.ion()
+# Color of each class of 1-simplex, one LineCollection per class drawn in EDGE_CLASSES order (the last one on top)
+EDGE_COLORS = {
+    'normal': 'orange',
+    'exception': 'yellow',
+    'obstacle': 'red',
+    'frontier': 'blue',
+    'skeleton': 'green',
+}
+
+
+class MapView:
+    """
+    Retained mode view of a map and the swarm on it: the artists are created once and draw() only updates their data
+    from a Snapshot.
+
+    With blit=True the map is drawn once and kept as a background; each frame restores it and redraws the robots,
+    1-simplices and labels on top, falling back to a full redraw on canvases that can't blit. blit=False draws every
+    artist normally, as needed to save frames with savefig. Robot ids are most of the drawing time of large swarms,
+    labels=False leaves them out.
+    """
+
+    def __init__(self, sim_map: Map, labels: bool = True, blit: bool = True):
         fig = plt.figure()
         fig.suptitle('Swarm Simulation')
         ax = fig.add_subplot(111)
         ax.grid()
-        (m_x1, m_y1), (m_x2, m_y2) = controller.map.boundary
+        (m_x1, m_y1), (m_x2, m_y2) = sim_map.boundary
         map_margin = 0.0
         ax.update_datalim([[m_x1 - map_margin, m_y1 - map_margin], [m_x2 + map_margin, m_y2 + map_margin]])
         ax.autoscale_view()
@@ -27,81 +49,120 @@ class Plot:
                                lw=5))
 
         # draw obstacles
-        for (o_x1, o_y1), (o_x2, o_y2) in controller.map.obstacles:
+        for (o_x1, o_y1), (o_x2, o_y2) in sim_map.obstacles:
             rect = matplotlib.patches.Rectangle((o_x1, o_y1),
                                                 o_x2 - o_x1, o_y2 - o_y1,
                                                 color='grey')
             ax.add_patch(rect)
-     
-        self.ax = ax
-        self.robots_obstacle_scatter = ax.scatter([], [], color='red', label='robots in contact with obstacles')
-        self.skeleton_scatter = ax.scatter([], [], color='green', label='skeleton path')
-        self.robots_scatter = ax.scatter([], [], color=[1., 0.63647424, 0.33815827, 1.], label='robots')
-        self.controller = controller
-        self.simplices, self.texts = [], {}
+
+        self.fig, self.ax = fig, ax
+        self.canvas = fig.canvas
+        self.labels = labels
+        self.blit = blit
+
+        self.edge_collections = [ax.add_collection(LineCollection([], colors=EDGE_COLORS[name], animated=blit))
+                                 for name in EDGE_CLASSES]
+        self.robots_obstacle_scatter = ax.scatter([], [], color='red', label='robots in contact with obstacles',
+                                                  animated=blit)
+        self.skeleton_scatter = ax.scatter([], [], color='green', label='skeleton path', animated=blit)
+        self.robots_scatter = ax.scatter([], [], color=[1., 0.63647424, 0.33815827, 1.], label='robots',
+                                         animated=blit)
+        self.texts = []
         self.ax.legend()
-        self.update_plot()
 
-    def update_plot(self):
-        # plotting robots ids
-        for r_index in range(len(self.controller.robots)):
-            if r_index in self.texts:
-                self.texts[r_index].remove()
-            self.texts[r_index] = plt.text(self.controller.robots[r_index][0], self.controller.robots[r_index][1], str(r_index))
-
-        # plotting the one-simplices edges
-        skeleton_path_simplices = [sorted([p1, p2]) for p1, p2 in
-                                   zip(self.controller.skeleton_path[:-1], self.controller.skeleton_path[1:])] \
-                                    if len(self.controller.skeleton_path) > 1 else []
-        # plotting robots
-        robot_x, robot_y = [], []
-        for i, (x, y) in enumerate(self.controller.robots):
-            if i in self.controller.skeleton_path or self.controller.robot_is_obstacle[i]:
-                continue
-            robot_x.append(x)
-            robot_y.append(y)
-        self.robots_scatter.set_offsets(np.c_[robot_x, robot_y])
+        # What is currently drawn, to only update the artists that changed
+        self._positions = np.empty((0, 2))
+        self._edges = [np.empty((0, 2), dtype=int) for _ in EDGE_CLASSES]
+
+        self._background = None
+        if blit:
+            self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def draw(self, snapshot: Snapshot):
+        """Update the artists to snapshot and draw them"""
+        self.update(snapshot)
+        if not self.blit or self._background is None or not self.canvas.supports_blit:
+            self.canvas.draw()  # when blitting, _on_draw saves the background and draws the animated artists
+        else:
+            self.canvas.restore_region(self._background)
+            self._draw_animated()
+            self.canvas.blit(self.fig.bbox)
+        self.canvas.flush_events()
+
+    def update(self, snapshot: Snapshot):
+        """Update the artists to snapshot, without drawing"""
+        positions = snapshot.robots
+        moved = np.ones(len(positions), dtype=bool)
+        n_old = min(len(self._positions), len(positions))
+        moved[:n_old] = np.any(positions[:n_old] != self._positions[:n_old], axis=1)
+        self._positions = positions
 
-        robot_x, robot_y = [], []
-        for p in self.controller.skeleton_path:
-            robot_x.append(self.controller.robots[p][0])
-            robot_y.append(self.controller.robots[p][1])
-        self.skeleton_scatter.set_offsets(np.c_[robot_x, robot_y])
+        if self.labels:
+            self._update_labels(positions, moved)
+        self._update_robots(snapshot)
+        self._update_edges(snapshot, moved)
 
+    def _on_draw(self, event):
+        self._background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_animated()
+
+    def _draw_animated(self):
+        for collection in self.edge_collections:
+            self.fig.draw_artist(collection)
+        for artist in (self.robots_scatter, self.skeleton_scatter, self.robots_obstacle_scatter, *self.texts):
+            self.fig.draw_artist(artist)
+
+    def _update_labels(self, positions: np.ndarray, moved: np.ndarray):
+        # robot ids, texts are created for new robots and moved with their robot
+        for r_index in np.flatnonzero(moved[:len(self.texts)]):
+            self.texts[r_index].set_position(positions[r_index])
+        for r_index in range(len(self.texts), len(positions)):
+            x, y = positions[r_index]
+            self.texts.append(self.ax.text(x, y, str(r_index), animated=self.blit))
+        # a replay can go back to an iteration with less robots
+        for text in self.texts[len(positions):]:
+            text.remove()
+        del self.texts[len(positions):]
+
+    def _update_robots(self, snapshot: Snapshot):
+        positions = snapshot.robots
+        in_skeleton_path = np.zeros(len(positions), dtype=bool)
+        in_skeleton_path[snapshot.skeleton_path] = True
+
+        self.robots_scatter.set_offsets(positions[~(snapshot.robot_is_obstacle | in_skeleton_path)])
+        self.skeleton_scatter.set_offsets(positions[snapshot.skeleton_path].reshape(-1, 2))
         # robots that are in contact with obstacle: red
-        robot_x, robot_y = [], []
-        for p in [index for index, status in self.controller.robot_is_obstacle.items() if status]:
-            robot_x.append(self.controller.robots[p][0])
-            robot_y.append(self.controller.robots[p][1])
-        self.robots_obstacle_scatter.set_offsets(np.c_[robot_x, robot_y])
-
-        if self.simplices:
-            for line in self.simplices:
-                line.remove()
-            self.simplices = []
-
-        for exception_simplex in self.controller.exception_one_simplices:
-            x1, y1 = self.controller.robots[exception_simplex[0]]
-            x2, y2 = self.controller.robots[exception_simplex[1]]
-            if exception_simplex in skeleton_path_simplices:
-                self.simplices.append(self.ax.plot([x1, x2], [y1, y2], color='green')[0])
-            else:
-                self.simplices.append(self.ax.plot([x1, x2], [y1, y2], color='yellow')[0])
-
-        for one_simplex in self.controller.simplices[1]:
-            if one_simplex in self.controller.exception_one_simplices:
+        self.robots_obstacle_scatter.set_offsets(positions[snapshot.robot_is_obstacle])
+
+    def _update_edges(self, snapshot: Snapshot, moved: np.ndarray):
+        # Only the collections whose 1-simplices changed or have a robot that moved get new segments
+        for edge_class, collection in enumerate(self.edge_collections):
+            class_edges = snapshot.edges[snapshot.edge_classes == edge_class]
+            if np.array_equal(class_edges, self._edges[edge_class]) and not moved[class_edges].any():
                 continue
-            
-            x1, y1 = self.controller.robots[one_simplex[0]]
-            x2, y2 = self.controller.robots[one_simplex[1]]
-            # TODO: Make the 1 simplex and 2 simplex as tuples so that [0,2] = [2,0]
-            if one_simplex in skeleton_path_simplices:
-                self.simplices.append(self.ax.plot([x1, x2], [y1, y2], color='green')[0])
-            elif one_simplex in self.controller.fence_subcomplex.frontier_simplices:
-                self.simplices.append(self.ax.plot([x1, x2], [y1, y2], color='blue')[0])
-            elif one_simplex in self.controller.fence_subcomplex.obstacle_simplices:
-                self.simplices.append(self.ax.plot([x1, x2], [y1, y2], color='red')[0])
-            else:
-                self.simplices.append(self.ax.plot([x1, x2], [y1, y2], color='orange')[0])
-
-        plt.pause(0.01)
+            self._edges[edge_class] = class_edges
+            collection.set_segments(snapshot.robots[class_edges])
+
+
+class Plot(MapView):
+    """
+    Live view of a controller (see Controller.plot). With every=N the view is only redrawn on one out of N calls to
+    update_plot.
+    """
+
+    def __init__(self, controller, every: int = 1, labels: bool = True):
+        plt.ion()
+        super().__init__(controller.map, labels)
+        self.controller = controller
+        self.every = every
+        self._calls = 0
+        plt.show(block=False)
+        self.update_plot()
+
+    def update_plot(self):
+        self._calls += 1
+        if (self._calls - 1) % self.every == 0:
+            self.redraw()
+
+    def redraw(self):
+        self.draw(take_snapshot(self.controller))